@@ -1,134 +1,187 @@
+"""
+Generate cells_xtra.v, black boxes for the Xilinx primitives, from the text
+of the Vivado 7 series libraries guide (UG953).
+
+The text is read in one pass. Each primitive's section starts with a line
+naming it, followed by a "Macro:" or "Primitive:" header line, and the
+parameters and ports are read from its VHDL instantiation template.
+"""
 
 import re
+from collections import OrderedDict
+
+from jinja2 import Template
+
 header = re.compile('(acro:|imitive:)')
 caps_only = re.compile('^[A-Z0-9_]+$')
-vhdl_param = re.compile('([A-Z0-9_]+)\s*=>\s*([XOB]?"[^"]*"|[0-9.]+|[A-Z0-9_]+)[^-]*(--.*)?')
+vhdl_param = re.compile(r'([A-Z0-9_]+)\s*=>\s*([XOB]?"[^"]*"|[0-9.]+|[A-Z0-9_]+)[^-]*(--.*)?')
 vhdl_template = re.compile('--.*Xilinx.*HDL.*Language.*Template')
+non_digits = re.compile('[^0-9A-Fa-f]')
+blank_lines = re.compile('\n\n+')
+
+bit_extract = re.compile(r'\s*([0-9]*)\s*.bit[^i]*(input|output):')
+output_filter = re.compile(r'\s(output\s+(register|clock|control)|enable\s+output)')
+
+# Number of bits for each digit of a B"...", O"..." or X"..." literal.
+literal_bits = {'B': (1, 2), 'O': (3, 8), 'X': (4, 16)}
+
+
+def parse_param(init_value):
+    """Work out the Verilog type and value of a parameter from its value in
+    the VHDL template."""
+    init_value = init_value.strip()
+    if init_value.endswith('"'):
+        if init_value[0] in literal_bits:
+            # Binary, octal or hexadecimal, as a vector as wide as the literal
+            bits, base = literal_bits[init_value[0]]
+            digits = non_digits.sub('', init_value[2:-1])
+            width = bits * len(digits)
+            init_type = '[%i:0]' % (width - 1)
+            init_value = "%i'h%x" % (width, int(digits, base))
+        else:
+            assert init_value.startswith('"')
+            init_type = '' # A String
+    elif init_value == 'FALSE':
+        init_type = ''
+        init_value = '"FALSE"'
+    elif init_value == 'TRUE':
+        init_type = ''
+        init_value = '"TRUE"'
+    elif '.' in init_value:
+        init_type = 'real'
+        init_value = float(init_value)
+    else:
+        init_type = 'integer'
+        init_value = int(init_value)
+    return init_type, init_value
 
-bit_extract = re.compile('\s*([0-9]*)\s*.bit[^i]*(input|output):')
-output_filter = re.compile('\s(output\s+(register|clock|control)|enable\s+output)')
 
-bits = {}
-current_header = ''
+def parse_port(obj_name, line, port_name, port_comment):
+    """Work out the Verilog type and direction of a port from its comment in
+    the VHDL template."""
+    if not port_comment:
+        port_comment = ''
 
-i = 0
-lines = open('ug953-vivado-7series-libraries.2.txt').readlines()
-while i < len(lines):
-    line = lines[i]
-    if current_header not in bits:
-        bits[current_header] = []
-    bits[current_header].append(line.strip())
-    i += 1
+    b = bit_extract.search(port_comment)
+    if b:
+        width = int(b.group(1))
+        modes = [b.group(2)]
+    else:
+        assert not 'bit ' in port_name, port_name
+        width = 1
 
-    if header.search(line):
-        header_name_line = ''
-        j = 2
-        while not header_name_line:
-            header_name_line = lines[i-j].strip()
-            j += 1
-        if not caps_only.match(header_name_line):
-            continue
+        modes = []
+        if 'input' in port_comment:
+            modes.append('input')
+        if 'output' in output_filter.sub('', port_comment):
+            # Hack to work around tristate input on iobufs
+            if not obj_name.startswith('IOBUF') or not line.startswith('T'):
+                modes.append('output')
 
-        current_header = header_name_line
+        if not modes:
+            modes.append('input')
 
+    assert len(modes) == 1, (modes, obj_name, line)
 
-from collections import OrderedDict
-modules = {}
-for obj_name in sorted(bits):
-    lines = list(bits[obj_name])
-
-    while lines and not vhdl_template.search(lines[0]):
-        lines.pop(0)
-    if len(lines) > 1:
-        lines.pop(0)
+    if width == 1:
+        port_type = ''
     else:
-        print("No template for ", obj_name)
-
-    param_lines = OrderedDict()
-    while lines and 'port map' not in lines[0]:
-        m = vhdl_param.match(lines[0])
-        if m:
-            init_name, init_value, init_comment = m.groups()
-            init_value = init_value.strip()
-            if init_value.endswith('"'):
-                if init_value.startswith('B"'): # Binary
-                    init_value = int("".join(i for i in init_value if i in ('0', '1')), 2)
-                elif init_value.startswith('O"'): # Octal
-                    init_value = int(init_value[2:-1], 8)
-                elif init_value.startswith('X"'): # Hexidecimal
-                    init_value = int(init_value[2:-1], 16)
-                else:
-                    assert init_value.startswith('"')
-                    init_type = '' # A String
-            elif init_value == 'FALSE':
-                init_type = ''
-                init_value = '"FALSE"'
-            elif init_value == 'TRUE':
-                init_type = ''
-                init_value = '"TRUE"'
-            elif '.' in init_value:
-                init_type = 'real'
-                init_value = float(init_value)
-            else:
-                print(obj_name, repr(lines[0]), repr(init_value))
-                init_type = 'integer'
-                init_value = int(init_value)
-
-            param_lines[init_name] = (init_type, init_value)
-        lines.pop(0)
-
-    port_lines = OrderedDict()
-    while lines and '-- End of' not in lines[0]:
-        m = vhdl_param.match(lines[0])
-        if m:
-            port_name, _, port_comment = m.groups()
-            if not port_comment:
-                port_comment = ''
-
-            b = bit_extract.search(port_comment)
-            if b:
-                width = int(b.group(1))
-                modes = [b.group(2)]
-            else:
-                assert not 'bit ' in m.group(1), m.group(1)
-                width = 1
-
-                modes = []
-                if 'input' in port_comment:
-                    modes.append('input')
-                if 'output' in output_filter.sub('', port_comment):
-                    # Hack to work around tristate input on iobufs
-                    if not obj_name.startswith('IOBUF') or not lines[0].strip().startswith('T'):
-                        modes.append('output')
-
-                if not modes:
-                    modes.append('input')
-
-            assert len(modes) == 1, (modes, obj_name, lines[0])
-
-            if width == 1:
-                port_type = ''
-            else:
-                port_type = '[%s:]' % width
-                print(obj_name, port_name, port_type)
-
-            port_lines[port_name] = (port_type, modes[0])
-        lines.pop(0)
-
-    print()
-    print(obj_name)
-    print("-"*75)
-    for i in param_lines:
-        print(i)
-    print("-"*75)
-    for i in port_lines:
-        print(i)
-    print("="*75)
-
-    modules[obj_name] = (param_lines, port_lines)
-
-
-from jinja2 import Template
-template = Template(open('cells_xtra.v.jinja2').read())
-with open('cells_xtra.v', 'w') as f:
-    f.write(re.sub('\n\n+', '\n\n', template.render(modules=modules)))
+        port_type = '[%s:]' % width
+    return port_type, modes[0]
+
+
+class ModuleParser:
+    """Reads the parameters and ports of one primitive from the lines of its
+    section, one line at a time."""
+
+    # States
+    TEMPLATE, PARAMS, PORTS, DONE = range(4)
+
+    def __init__(self, name):
+        self.name = name
+        self.state = self.TEMPLATE
+        self.params = OrderedDict()
+        self.ports = OrderedDict()
+
+    def feed(self, line):
+        """Read the next line, returns True when the end of the template is
+        reached."""
+        if self.state == self.TEMPLATE:
+            if vhdl_template.search(line):
+                self.state = self.PARAMS
+            return False
+
+        if self.state == self.PARAMS:
+            if 'port map' not in line:
+                m = vhdl_param.match(line)
+                if m:
+                    init_name, init_value, init_comment = m.groups()
+                    self.params[init_name] = parse_param(init_value)
+                return False
+            self.state = self.PORTS
+
+        if self.state == self.PORTS:
+            if '-- End of' in line:
+                self.state = self.DONE
+                return True
+            m = vhdl_param.match(line)
+            if m:
+                port_name, _, port_comment = m.groups()
+                port_type, port_dir = parse_port(self.name, line, port_name, port_comment)
+                self.ports[port_name] = (port_type, port_dir)
+        return False
+
+
+def parse(lines):
+    """Read the primitives from the lines of the guide, yielding
+    (name, params, ports) for each as soon as its template has been read."""
+    current = ModuleParser('')
+    parsers = {'': current}
+    previous_line = ''
+    for line in lines:
+        stripped = line.strip()
+        if current.state != current.DONE and current.feed(stripped):
+            yield current.name, current.params, current.ports
+
+        # The name of the primitive is on the last non-blank line before the
+        # header.
+        if header.search(line) and caps_only.match(previous_line):
+            if previous_line not in parsers:
+                parsers[previous_line] = ModuleParser(previous_line)
+            current = parsers[previous_line]
+
+        if stripped:
+            previous_line = stripped
+
+    # Primitives whose template didn't end before the end of the file.
+    for parser in parsers.values():
+        if parser.state in (parser.PARAMS, parser.PORTS):
+            yield parser.name, parser.params, parser.ports
+        elif parser.state == parser.TEMPLATE:
+            print("No template for ", parser.name)
+
+
+def main():
+    modules = {}
+    with open('ug953-vivado-7series-libraries.2.txt') as f:
+        for obj_name, param_lines, port_lines in parse(f):
+            print()
+            print(obj_name)
+            print("-"*75)
+            for i in param_lines:
+                print(i)
+            print("-"*75)
+            for i in port_lines:
+                print(i)
+            print("="*75)
+
+            modules[obj_name] = (param_lines, port_lines)
+
+    with open('cells_xtra.v.jinja2') as f:
+        template = Template(f.read())
+    with open('cells_xtra.v', 'w') as f:
+        f.write(blank_lines.sub('\n\n', template.render(modules=modules)))
+
+
+if __name__ == "__main__":
+    main()
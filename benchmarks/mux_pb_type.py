@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for building mux <pb_type> XML.
+
+The workload mimics `artix7/utils/prjxray-int-import.py` generating an INT
+tile, hundreds of routing muxes with one output and between 2 and 30 single
+bit inputs, each with their own names. It times `lib.mux.pb_type_xml` (which
+copies a cached template for each shape of mux) against building every mux's
+XML from scratch, and checks they produce the same XML.
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import lxml.etree as ET
+
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(MYDIR, "..", "utils"))
+
+from lib import mux as mux_lib
+
+parser = argparse.ArgumentParser(description=__doc__.strip())
+parser.add_argument(
+    "--muxes", type=int, default=600,
+    help="Number of routing muxes in the tile.")
+parser.add_argument(
+    "--repeat", type=int, default=5,
+    help="Number of times to time the workload, the best time is reported.")
+parser.add_argument(
+    "--seed", type=int, default=0,
+    help="Seed for generating the mux names and widths.")
+
+WIRES = ["EE2", "EE4", "NN2", "NN6", "SS2", "SS6", "WW2", "WW4", "NE2", "SW6", "LOGIC_OUTS", "IMUX", "BYP", "GFAN"]
+
+
+def int_tile_workload(muxes, seed):
+    """Return a list of (mux name, pins) like the routing muxes in an INT
+    tile."""
+    rng = random.Random(seed)
+    workload = []
+    for i in range(muxes):
+        pins = [(mux_lib.MuxPinType.OUTPUT, "OUT", 1, 0)]
+        for j in range(rng.randint(2, 30)):
+            src = "%s%s%i" % (rng.choice(WIRES), rng.choice(["BEG", "END"]), j)
+            pins.append((mux_lib.MuxPinType.INPUT, src, 1, 0))
+        workload.append(("%s%s%i" % (rng.choice(WIRES), "BEG", i), pins))
+    return workload
+
+
+def from_template(workload):
+    return [mux_lib.pb_type_xml(mux_lib.MuxType.ROUTING, name, pins) for name, pins in workload]
+
+
+def from_scratch(workload):
+    return [
+        mux_lib._build_pb_type_xml(
+            mux_lib.MuxType.ROUTING, mux_lib._full_mux_name(mux_lib.MuxType.ROUTING, name), pins, None, 1, "")
+        for name, pins in workload
+    ]
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+    workload = int_tile_workload(args.muxes, args.seed)
+
+    for a, b in zip(from_template(workload), from_scratch(workload)):
+        assert ET.tostring(a) == ET.tostring(b), (ET.tostring(a), ET.tostring(b))
+
+    print("{} routing muxes, {} shapes".format(len(workload), len(set(len(p) for _, p in workload))))
+    for name, func in (("from scratch", from_scratch), ("template", from_template)):
+        best = min(timeit.repeat(lambda: func(workload), number=1, repeat=args.repeat))
+        print("{:>12}: {:8.2f} us per mux, {:8.2f} ms per tile".format(
+            name, best / len(workload) * 1e6, best * 1e3))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for generating rr_graphs.
+
+Runs `utils/icebox-rr_graph-import.py` for each iCE40 device and
+`artix7/utils/prjxray-routing-import.py` for increasing regions of interest,
+up to the full grid. For each run the wall time, peak RSS, number of nodes
+and edges and size of the rr_graph written are recorded and compared with the
+baseline in `rr_graph_baseline.json`. The exit code is non-zero when a run
+fails or is worse than the baseline by more than its thresholds.
+
+The `artix7-fixture` case runs the Artix 7 importer on the tiny hand written
+database and rr_graph in `fixtures/artix7`, so there is always a case which
+runs offline. The baseline stored in the repository only has its node, edge
+and byte counts, as the times and RSS depend on the machine; create a full
+baseline with `--update-baseline` on the machine the benchmarks are compared
+on. The exit code is also non-zero when every case was skipped.
+
+The inputs can be local copies so it runs offline:
+ - icebox (from IceStorm) is imported from --icebox, or the Python path.
+ - The Project X-Ray database is read from --prjxray-db.
+ - The Artix 7 importer patches the rr_graph written by VPR for the device,
+   given with --artix7-rr-graph.
+Cases whose inputs can't be found are skipped.
+"""
+
+import argparse
+import fnmatch
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import lxml.etree as ET
+
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.abspath(os.path.join(MYDIR, ".."))
+
+ICEBOX_IMPORT = os.path.join(TOPDIR, "utils", "icebox-rr_graph-import.py")
+PRJXRAY_IMPORT = os.path.join(TOPDIR, "artix7", "utils", "prjxray-routing-import.py")
+
+FIXTURE_DIR = os.path.join(MYDIR, "fixtures", "artix7")
+
+DEFAULT_BASELINE = os.path.join(MYDIR, "rr_graph_baseline.json")
+
+# Bump when the format of the baseline changes.
+BASELINE_VERSION = 1
+
+# How much worse than the baseline a run can be before it fails, used when
+# the baseline doesn't give them.
+DEFAULT_THRESHOLDS = {
+    "time": 1.25,
+    "rss": 1.25,
+    "bytes": 1.10,
+    "nodes": 1.0,
+    "edges": 1.0,
+}
+
+# The region of interest used by tests/Makefile.artix7.
+TESTS_ROI = (35, 1, 38, 3)
+
+parser = argparse.ArgumentParser(description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument(
+    "--case", action="append", default=[],
+    help="Only run the cases matching this glob (can be given many times).")
+parser.add_argument(
+    "--repeat", type=int, default=1,
+    help="Run each case this many times, the best time and RSS are recorded.")
+parser.add_argument(
+    "--icebox", default=os.environ.get("ICEBOX", None),
+    help="Directory containing icebox.py.")
+parser.add_argument(
+    "--prjxray-db", default=os.path.join(TOPDIR, "third_party", "prjxray-db", "artix7"),
+    help="Project X-Ray database for the Artix 7.")
+parser.add_argument(
+    "--artix7-rr-graph", default=None,
+    help="rr_graph written by VPR for the Artix 7 device.")
+parser.add_argument(
+    "--baseline", default=DEFAULT_BASELINE,
+    help="Baseline to compare against.")
+parser.add_argument(
+    "--update-baseline", action="store_true",
+    help="Store the results of this run as the baseline.")
+parser.add_argument(
+    "--output", "-o", default=None,
+    help="Also write the results as JSON to this file.")
+
+
+class Case:
+    """One run of an importer."""
+
+    def __init__(self, name, cmd, output, env=None, missing=None):
+        self.name = name
+        self.cmd = cmd
+        self.output = output
+        self.env = env
+        # Why the case can't run, or None.
+        self.missing = missing
+
+
+def icebox_cases(args):
+    env = dict(os.environ)
+    missing = None
+    if args.icebox:
+        if os.path.exists(os.path.join(args.icebox, "icebox.py")):
+            env["PYTHONPATH"] = os.pathsep.join(p for p in (args.icebox, env.get("PYTHONPATH")) if p)
+        else:
+            missing = "no icebox.py in {}".format(args.icebox)
+    elif importlib.util.find_spec("icebox") is None:
+        missing = "icebox not found, use --icebox"
+
+    for device, flags in (("384", ["-3"]), ("1k", []), ("5k", ["-5"]), ("8k", ["-8"])):
+        yield Case(
+            "ice40-{}".format(device),
+            [sys.executable, ICEBOX_IMPORT] + flags,
+            "rr_graph.xml",
+            env=env,
+            missing=missing,
+        )
+
+
+def grid_size(database):
+    """Return the largest x and y in the tile grid of a database."""
+    with open(os.path.join(database, "tilegrid.json")) as f:
+        tiles = json.load(f)["tiles"].values()
+    return max(t["grid_x"] for t in tiles), max(t["grid_y"] for t in tiles)
+
+
+def rois(grid_max):
+    """Return increasing regions of interest (name, start x, start y, end x,
+    end y), starting from the tests' region and ending with the full grid.
+
+    >>> for roi in rois((100, 150)): print(roi)
+    ('tests', 35, 1, 38, 3)
+    ('quarter', 0, 0, 25, 37)
+    ('half', 0, 0, 50, 75)
+    ('full', 0, 0, 100, 150)
+    """
+    max_x, max_y = grid_max
+    roi = [("tests",) + TESTS_ROI]
+    for name, fraction in (("quarter", 4), ("half", 2)):
+        roi.append((name, 0, 0, max_x // fraction, max_y // fraction))
+    roi.append(("full", 0, 0, max_x, max_y))
+    return roi
+
+
+def prjxray_cmd(database, rr_graph, roi=None):
+    """Command line to run the Artix 7 importer, on a region of interest
+    (start x, start y, end x, end y) or the whole grid."""
+    cmd = [
+        sys.executable, PRJXRAY_IMPORT,
+        "--database", os.path.abspath(database),
+        "--read_rr_graph", os.path.abspath(rr_graph),
+        "--write_rr_graph", "rr_graph.xml",
+    ]
+    if roi is not None:
+        for arg, value in zip(("--start_x", "--start_y", "--end_x", "--end_y"), roi):
+            cmd += [arg, str(value)]
+    return cmd
+
+
+def fixture_cases(args):
+    yield Case(
+        "artix7-fixture",
+        prjxray_cmd(FIXTURE_DIR, os.path.join(FIXTURE_DIR, "rr_graph.xml")),
+        "rr_graph.xml",
+    )
+
+
+def prjxray_cases(args):
+    missing = None
+    if not os.path.exists(os.path.join(args.prjxray_db, "tilegrid.json")):
+        missing = "no Project X-Ray database in {}, use --prjxray-db".format(args.prjxray_db)
+        roi = rois((TESTS_ROI[2], TESTS_ROI[3]))
+    else:
+        roi = rois(grid_size(args.prjxray_db))
+    if not missing and not args.artix7_rr_graph:
+        missing = "no rr_graph to patch, use --artix7-rr-graph"
+
+    for name, start_x, start_y, end_x, end_y in roi:
+        yield Case(
+            "artix7-roi-{}".format(name),
+            prjxray_cmd(args.prjxray_db, args.artix7_rr_graph or "", (start_x, start_y, end_x, end_y)),
+            "rr_graph.xml",
+            missing=missing,
+        )
+
+
+def count_nodes_edges(path):
+    """Count the nodes and edges in an rr_graph."""
+    nodes = edges = 0
+    for _, elem in ET.iterparse(path, events=("end",), tag=("node", "edge")):
+        if elem.tag == "node":
+            nodes += 1
+        else:
+            edges += 1
+        elem.clear()
+    return nodes, edges
+
+
+def run(case):
+    """Run a case in a temporary directory and return its measurements."""
+    with tempfile.TemporaryDirectory(prefix="rr_graph_bench.") as tmpdir:
+        with open(os.path.join(tmpdir, "log.txt"), "wb") as log:
+            start = time.perf_counter()
+            p = subprocess.Popen(case.cmd, cwd=tmpdir, env=case.env, stdout=log, stderr=subprocess.STDOUT)
+            _, status, rusage = os.wait4(p.pid, 0)
+            elapsed = time.perf_counter() - start
+            p.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+        if p.returncode != 0:
+            with open(os.path.join(tmpdir, "log.txt"), "rb") as f:
+                tail = f.read()[-2000:].decode("utf-8", "replace")
+            raise RuntimeError("{} failed with {}:\n{}".format(case.name, p.returncode, tail))
+
+        output = os.path.join(tmpdir, case.output)
+        nodes, edges = count_nodes_edges(output)
+        return {
+            "time": elapsed,
+            # ru_maxrss is in kilobytes on Linux.
+            "rss": rusage.ru_maxrss * 1024,
+            "nodes": nodes,
+            "edges": edges,
+            "bytes": os.path.getsize(output),
+        }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return dict(DEFAULT_THRESHOLDS), {}
+    if data.get("version") != BASELINE_VERSION:
+        return dict(DEFAULT_THRESHOLDS), {}
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    thresholds.update(data.get("thresholds", {}))
+    return thresholds, data.get("results", {})
+
+
+def save_baseline(path, thresholds, results):
+    with open(path, "w") as f:
+        json.dump({
+            "version": BASELINE_VERSION,
+            "thresholds": thresholds,
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(result, baseline, thresholds):
+    """Return a list of the measurements worse than the baseline by more
+    than their threshold.
+
+    >>> t = {"time": 1.25, "nodes": 1.0}
+    >>> compare({"time": 1.2, "nodes": 10}, {"time": 1.0, "nodes": 10}, t)
+    []
+    >>> compare({"time": 1.3, "nodes": 11}, {"time": 1.0, "nodes": 10}, t)
+    ['time 1.3 > 1.0 * 1.25', 'nodes 11 > 10 * 1.0']
+    """
+    worse = []
+    for key, threshold in thresholds.items():
+        if key not in result or key not in baseline:
+            continue
+        if result[key] > baseline[key] * threshold:
+            worse.append("{} {} > {} * {}".format(key, result[key], baseline[key], threshold))
+    return worse
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    cases = list(fixture_cases(args)) + list(icebox_cases(args)) + list(prjxray_cases(args))
+    if args.case:
+        cases = [c for c in cases if any(fnmatch.fnmatch(c.name, p) for p in args.case)]
+
+    thresholds, baseline = load_baseline(args.baseline)
+
+    results = {}
+    failed = False
+    no_baseline = []
+    print("{:24} {:>10} {:>10} {:>10} {:>10} {:>12}  {}".format(
+        "case", "time (s)", "RSS (MB)", "nodes", "edges", "bytes", "vs baseline"))
+    for case in cases:
+        if case.missing:
+            print("{:24} skipped, {}".format(case.name, case.missing))
+            continue
+
+        try:
+            runs = [run(case) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print("{:24} FAILED".format(case.name))
+            print(e, file=sys.stderr)
+            failed = True
+            continue
+
+        result = dict(runs[0])
+        result["time"] = min(r["time"] for r in runs)
+        result["rss"] = min(r["rss"] for r in runs)
+        results[case.name] = result
+
+        if case.name not in baseline:
+            status = "no baseline"
+            no_baseline.append(case.name)
+        else:
+            worse = compare(result, baseline[case.name], thresholds)
+            status = "WORSE: " + ", ".join(worse) if worse else "ok"
+            failed = failed or bool(worse)
+
+        print("{:24} {:10.2f} {:10.1f} {:10} {:10} {:12}  {}".format(
+            case.name, result["time"], result["rss"] / 2**20,
+            result["nodes"], result["edges"], result["bytes"], status))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline.update(results)
+        save_baseline(args.baseline, thresholds, baseline)
+        print("Updated", args.baseline)
+        return 0
+
+    if no_baseline:
+        print("No baseline for {}, create one with --update-baseline".format(", ".join(no_baseline)))
+
+    if not results and not failed:
+        print("Every case was skipped, nothing was measured!", file=sys.stderr)
+        return 1
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -16,54 +16,11 @@ depend_on_only  = $(1)
 depend_on_deps  = $(call deps_dir,$(subst ./,,$(dir $(1)))$(notdir $(1))$(DEPS_EXT))
 depend_on_all   = $(call depend_on_only,$(1)) $(call depend_on_deps,$(1))
 
-
-DEPMK_EXT=.dmk
-deps_makefile  = $(call deps_dir,$(subst ./,,$(dir $(1)))$(notdir $(1))$(DEPMK_EXT))
-
-# Add a dependency from X onto Y
-define _deps_rule
-$(1): $(2)
-endef
-
-define _deps_expand_rule
-
-# Force expansion of arguments right now
-DEPS_EXPANDED_ONTO := $(1)
-DEPS_EXPANDED_FROM := $(2)
-
-$$(eval $$(call _deps_rule,$$(DEPS_EXPANDED_ONTO),$$(DEPS_EXPANDED_FROM)))
-
-undefine DEPS_EXPANDED_ONTO
-undefine DEPS_EXPANDED_FROM
-
-endef
-
-define _add_dependency
-
-ADD_DEP_ONTO := $(1)
-ADD_DEP_FROM := $(2)
-
-ifneq (,$$(call find_files,$$(ADD_DEP_FROM)))
-
-$$(eval $$(call _deps_expand_rule,$$(call depend_on_deps,$$(ADD_DEP_ONTO)),$$(call depend_on_all,$$(ADD_DEP_FROM))))
-
-else
-
-$$(warning File $$(ADD_DEP_FROM) is missing! (and no generation rule either!))
-
-ifeq (2,$(V))
-$$(warning Found files in same directory: $$(call find_files,$$(dir $$(ADD_DEP_FROM))*))
-endif
-
-endif
-
-undefine ADD_DEP_FROM
-undefine ADD_DEP_ONTO
-
-endef
-
 MKDIR_TARGET = @mkdir -p $(dir $(TARGET))
 
+$(TOP_DIR)/.deps:
+	@mkdir -p $(TARGET)
+
 # Create a target that can be referenced which is a file and all it's
 # dependencies.
 #
@@ -73,11 +30,6 @@ MKDIR_TARGET = @mkdir -p $(dir $(TARGET))
 # This file also *must* exist, otherwise the things depending on it will always
 # get rerun.
 
-# $(call add_dependency,filex,included_file1 included_file2)
-# Creates the following dependency chain,
-# a.d: b b.d
-add_dependency = $(foreach DEP,$(2),$(eval $(call _add_dependency,$(1),$(DEP))))
-
 ifeq (,$(call should_not_include))
 
 ifeq (2,$(V))
@@ -86,52 +38,45 @@ $(info Setting up .d files.)
 $(info --------------------------------------------------------------------------)
 endif
 
-NEEDS_DEPS_FILES := $(call find_files,*)
-
-$(foreach F,$(NEEDS_DEPS_FILES),$(eval $(call _deps_expand_rule,$(call depend_on_deps,$(F)),$(F))))
+# The merged XML files are made from the .d files, so they don't get .d files
+# of their own (the stamp below would have to wait for them).
+NEEDS_DEPS_FILES := $(filter-out %.merged.xml,$(call find_files,*))
 
 DEPS_FILES := $(foreach F,$(NEEDS_DEPS_FILES),$(call depend_on_deps,$(F)))
 
-$(DEPS_FILES):
-	$(MKDIR_TARGET)
+# Each .d file holds a hash of the contents of its file and everything the file
+# includes, and is only rewritten when that hash changes. Touching a file
+# without changing it (a git checkout, say) doesn't rebuild anything depending
+# on the .d file.
+#
+# All the .d files are updated by one run of newest.py, given the files which
+# changed since the last run. It only checks the .d files of those files and
+# the files which include them, and the stamp records when it last ran.
+NEWEST_TOOL := $(UTILS_DIR)/newest.py
+NEWEST_TOOL_FILES := $(NEWEST_TOOL) $(UTILS_DIR)/lib/stamps.py $(UTILS_DIR)/lib/deps.py
+
+DEPS_STAMP := $(TOP_DIR)/.deps/deps.stamp
+
+# .d files which have gone missing get written again too.
+DEPS_MISSING := $(filter-out $(wildcard $(DEPS_FILES)),$(DEPS_FILES))
+
+$(DEPS_STAMP): $(NEEDS_DEPS_FILES) $(NEWEST_TOOL_FILES) $(if $(DEPS_MISSING),deps-missing) | $(TOP_DIR)/.deps
+	$(file >$(TARGET).files,$(NEEDS_DEPS_FILES))
+	$(file >$(TARGET).graph,$(DEPS_GRAPH_INPUTS))
+	$(file >$(TARGET).changed,$?)
+	@$(NEWEST_TOOL) --deps-from $(TARGET).files --graph-from $(TARGET).graph --changed-from $(TARGET).changed
 	@touch $(TARGET)
 
+$(DEPS_FILES): $(DEPS_STAMP) ;
 
-#	$(NEWEST_TOOL) --output $(TARGET) $(PREREQ_ALL)
-
-ifeq (2,$(V))
-$(info)
-$(info Finished setting up .d files.)
-$(info --------------------------------------------------------------------------)
-endif
-
-#---------------------------------------------------------------------------------
-
-ifeq (2,$(V))
-$(info ==========================================================================)
-$(info Setting up .dmk generation for XML files.)
-$(info --------------------------------------------------------------------------)
-endif
-
-DEPS_XML_INPUTS  := $(call find_nontemplate_files,*.xml)
-DEPS_XML_OUTPUTS := $(foreach F,$(DEPS_XML_INPUTS),$(call deps_makefile,$(F)))
+deps-missing:
+	@true
 
-$(foreach F,$(DEPS_XML_INPUTS),$(eval $(call _deps_expand_rule,$(call deps_makefile,$(F)),$(F))))
-
-$(DEPS_XML_OUTPUTS):
-	$(MKDIR_TARGET)
-	@$(DEPS_XML_TOOL) $(PREREQ_FIRST)
-
-# Depend on the XML dependency generation tool
-DEPS_XML_TOOL := $(UTILS_DIR)/deps_xml.py
-DEPS_XML_TOOL_FILES := $(DEPS_XML_TOOL) $(UTILS_DIR)/lib/deps.py
-$(DEPS_XML_OUTPUTS): $(DEPS_XML_TOOL_FILES)
-
--include $(DEPS_XML_OUTPUTS)
+.PHONY: deps-missing
 
 ifeq (2,$(V))
 $(info)
-$(info Finished setting up .dmk generation for XML files.)
+$(info Finished setting up .d files.)
 $(info --------------------------------------------------------------------------)
 endif
 
@@ -139,30 +84,35 @@ endif
 
 ifeq (2,$(V))
 $(info ==========================================================================)
-$(info Setting up .dmk generation for Verilog files.)
+$(info Setting up the dependency graph.)
 $(info --------------------------------------------------------------------------)
 endif
 
-DEPS_VERILOG_INPUTS  := $(call find_nontemplate_files,*.v)
-DEPS_VERILOG_OUTPUTS := $(foreach F,$(DEPS_VERILOG_INPUTS),$(call deps_makefile,$(F)))
+# The transitive closure of the includes of every Verilog and XML file is
+# worked out by one run of deps_graph.py, which writes a single flattened
+# fragment with a rule for each .d file. The fragment is only rewritten when
+# the dependencies change, so make only restarts when it needs to; the stamp
+# records when it was last checked.
+DEPS_GRAPH_INPUTS := $(call find_nontemplate_files,*.xml) $(call find_nontemplate_files,*.v)
 
-$(foreach F,$(DEPS_VERILOG_INPUTS),$(eval $(call _deps_expand_rule,$(call deps_makefile,$(F)),$(F))))
+DEPS_GRAPH_TOOL := $(UTILS_DIR)/deps_graph.py
+DEPS_GRAPH_TOOL_FILES := $(DEPS_GRAPH_TOOL) $(UTILS_DIR)/lib/deps.py $(UTILS_DIR)/lib/includes.py
 
-$(DEPS_VERILOG_OUTPUTS):
-	$(MKDIR_TARGET)
-	@$(DEPS_VERILOG_TOOL) $(PREREQ_FIRST)
+DEPS_GRAPH_MK := $(TOP_DIR)/.deps/graph.mk
+DEPS_GRAPH_STAMP := $(DEPS_GRAPH_MK).stamp
 
-# Depend on the Verilog dependency generation tool
-DEPS_VERILOG_TOOL := $(UTILS_DIR)/deps_verilog.py
-DEPS_VERILOG_TOOL_FILES := $(DEPS_VERILOG_TOOL) $(UTILS_DIR)/lib/deps.py
+$(DEPS_GRAPH_STAMP): $(DEPS_GRAPH_INPUTS) $(DEPS_GRAPH_TOOL_FILES) $(FILES_MK) | $(TOP_DIR)/.deps
+	$(file >$(TARGET).list,$(DEPS_GRAPH_INPUTS))
+	@$(DEPS_GRAPH_TOOL) --output $(DEPS_GRAPH_MK) --files-from $(TARGET).list
+	@touch $(TARGET)
 
-$(DEPS_VERILOG_OUTPUTS): $(DEPS_VERILOG_TOOL_FILES)
+$(DEPS_GRAPH_MK): $(DEPS_GRAPH_STAMP) ;
 
--include $(DEPS_VERILOG_OUTPUTS)
+-include $(DEPS_GRAPH_MK)
 
 ifeq (2,$(V))
 $(info)
-$(info Finished setting up .dmk generation for Verilog files.)
+$(info Finished setting up the dependency graph.)
 $(info --------------------------------------------------------------------------)
 endif
 
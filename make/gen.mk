@@ -2,6 +2,7 @@ include make/inc/files.mk
 include make/inc/func.mk
 
 # Generate files
+include make/mux-batch.mk
 $(call include_type_all,mux) 	# Run Muxgen first
 $(call include_type_all,N)	# Then ntemplates
 $(call include_type_all,v2x)	# Then Verilog -> XML
@@ -16,7 +17,7 @@ gen-clean:
 clean: gen-clean
 
 redir:
-	@for DIR in $$($(UTILS_DIR)/listdirs.py); do \
+	@for DIR in $(DIRS_EXISTING); do \
 	  if [ ! -e $$DIR/Makefile ]; then \
 	    ln -sf $(abspath $(TOP_DIR)/make/redir.mk) $$DIR/Makefile; \
 	    export NEW_MAKEFILE=$$(echo $$DIR/Makefile | sed -e's@^$(TOP_DIR)/@@'); \
@@ -36,7 +37,7 @@ REDIR_EXCLUDE:=$(TOP_DIR)/.git/info/exclude.redir.mk
 
 $(REDIR_EXCLUDE): $(TOP_DIR)/make/gen.mk
 	@echo  "REDIR_MAKEFILES=\\" > $(TARGET)
-	@for DIR in $$($(UTILS_DIR)/listdirs.py); do \
+	@for DIR in $(DIRS_EXISTING); do \
 	  if [ $$(python -c"import os.path; print(os.path.realpath('$$DIR/Makefile'))") = $(abspath $(TOP_DIR)/make/redir.mk) ]; then \
 	    export NEW_MAKEFILE=$$(echo $$DIR/Makefile | sed -e's@^$(TOP_DIR)/@@'); \
 	    echo  "  $$NEW_MAKEFILE \\" >> $(TARGET); \
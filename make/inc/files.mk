@@ -1,18 +1,53 @@
 ifeq (,$(INC_FILES_MK))
 INC_FILES_MK := 1
 
-FILES_EXISTING := $(sort $(abspath $(shell $(TOP_DIR)/utils/listfiles.py)))
+# listfiles.py lists the files from the git index (or keeps a manifest of the
+# tree, so only the directories which changed are re-read), and only rewrites
+# the fragment if a file was added or removed. The fragment also sets
+# DIRS_EXISTING, so the directories don't need a separate walk.
+FILES_MK := $(TOP_DIR)/.deps/files.mk
+ifneq (ok,$(shell $(TOP_DIR)/utils/listfiles.py --makefile $(FILES_MK) && echo ok))
+$(error Unable to list the files in the repo)
+endif
+include $(FILES_MK)
+FILES_EXISTING := $(sort $(abspath $(FILES_EXISTING)))
 
 glob2regex = $(subst [^/]*[^/]*,.*,$(subst *,[^/]*,$(subst .,\.,$(1))))$$
 
-# Find files in a list.
-define _find_files_in
+# Find files in a list using grep, works for any glob.
+define _find_files_grep
 $(file >$(3))$(foreach O,$(2),$(file >>$(3),$(O)))
 $(shell grep -r '$(call glob2regex,$(1))' $(3))
 $(shell rm $(3))
 endef
 
-find_files_in = $(sort $(strip $(call _find_files_in,$(1),$(2),$(shell mktemp))))
+# The common kinds of glob are matched using make functions instead, which
+# avoids writing out the list and running grep for every query;
+#  * exact  - /abs/path
+#  * dir    - /abs/pre*suf     (* doesn't match across directories)
+#  * below  - /abs/pre**suf
+#  * suffix - *suf or **suf    (the regex isn't anchored at the start)
+_glob_stars = $(words $(filter *,$(subst *, * ,$(1))))
+_glob_pre   = $(patsubst x%,%,$(firstword $(subst *, ,x$(1)x)))
+_glob_suf   = $(patsubst %x,%,$(lastword $(subst *, ,x$(1)x)))
+
+_glob_kind = $(strip \
+	$(if $(filter /%,$(1)),\
+		$(if $(filter 0,$(call _glob_stars,$(1))),exact,\
+		$(if $(filter 1,$(call _glob_stars,$(1))),$(if $(findstring /,$(call _glob_suf,$(1))),grep,dir),\
+		$(if $(and $(filter 2,$(call _glob_stars,$(1))),$(findstring **,$(1))),below,grep))),\
+		$(if $(and $(filter **%,$(1)),$(filter 2,$(call _glob_stars,$(1)))),suffix,\
+		$(if $(and $(filter *%,$(1)),$(filter 1,$(call _glob_stars,$(1))),$(if $(findstring /,$(1)),,y)),suffix,grep))))
+
+_find_files_exact  = $(filter $(1),$(2))
+_find_files_suffix = $(filter %$(call _glob_suf,$(1)),$(2))
+_find_files_below  = $(filter $(call _glob_pre,$(1))%$(call _glob_suf,$(1)),$(2))
+_find_files_dir    = $(call _find_files_in_dir,$(call _glob_pre,$(1))%$(call _glob_suf,$(1)),$(2))
+_find_files_in_dir = $(foreach F,$(filter $(1),$(2)),$(if $(findstring /,$(patsubst $(1),%,$(F))),,$(F)))
+
+find_files_in = $(sort $(strip $(if $(filter grep,$(call _glob_kind,$(1))),\
+	$(call _find_files_grep,$(1),$(2),$(shell mktemp)),\
+	$(call _find_files_$(call _glob_kind,$(1)),$(1),$(2)))))
 #$(file >.files)$(foreach O,$(2),$(file >>.files,$(O)))$(shell grep -r '$(call glob2regex,$(1))' .files)))
 #find_files_in = $(sort $(shell ( $(foreach O,$(2),printf "%s\n" $(O);) ) | grep -r '$(call glob2regex,$(1))' -))
 
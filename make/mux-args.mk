@@ -113,6 +113,10 @@ ifneq (,$(MUX_SUBCKT))
 MUX_GEN_ARGS +=		--subckt	$(MUX_SUBCKT)
 endif
 
+ifeq (1,$(MUX_TREE))
+MUX_GEN_ARGS +=		--tree		1
+endif
+
 # ========================================================================
 # Clean up the used arguments
 # ------------------------------------------------------------------------
@@ -134,3 +138,4 @@ undefine MUX_SELECTS
 undefine MUX_SELECT
 
 undefine MUX_SUBCKT
+undefine MUX_TREE
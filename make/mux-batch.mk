@@ -0,0 +1,26 @@
+# Generate every mux described by a Makefile.mux with one run of mux_gen.py,
+# rather than starting it once per mux. make/types/mux.mk adds the directory
+# of each Makefile.mux to MUX_GEN_CONFIGS, with the mux_gen.py arguments for
+# it (worked out by make/mux-args.mk) in $(INC_DIR)_MUX_GEN_ARGS.
+MUX_GEN_CMD := $(realpath $(UTILS_DIR)/mux_gen.py)
+MUX_GEN_LIB := $(realpath $(UTILS_DIR)/lib)
+MUX_GEN_FILES := $(wildcard $(MUX_GEN_LIB)/*.py)
+
+# Number of muxes to generate in parallel.
+MUX_GEN_JOBS ?= 1
+
+MUX_GEN_STAMP := $(TOP_DIR)/.deps/mux_gen.stamp
+MUX_GEN_MANIFEST := $(MUX_GEN_STAMP).manifest
+MUX_GEN_CONFIGS :=
+
+$(MUX_GEN_STAMP): $(MUX_GEN_CMD) $(MUX_GEN_FILES) | $(TOP_DIR)/.deps
+	$(file >$(MUX_GEN_MANIFEST),# Generated by make/mux-batch.mk)
+	$(foreach D,$(MUX_GEN_CONFIGS),$(file >>$(MUX_GEN_MANIFEST),$($(D)_MUX_GEN_ARGS)))
+	$(call quiet_cmd,$(MUX_GEN_CMD) --jobs $(MUX_GEN_JOBS) --manifest $(MUX_GEN_MANIFEST),Generated $(GREEN)$(words $(MUX_GEN_CONFIGS))$(NC)muxes)
+	@touch $(TARGET)
+
+# Outputs which have gone missing get generated again too.
+mux-missing:
+	@true
+
+.PHONY: mux-missing
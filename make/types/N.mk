@@ -11,22 +11,33 @@ ifeq (,$($(INC_DIR)_FILES_INPUT_N))
 $(error $(INC_DIR)/Makefile.N: Unable to find any inputs!)
 endif
 
-$($(INC_DIR)_FILES_OUTPUT_N): INC_DIR := $(INC_DIR)
-$($(INC_DIR)_FILES_OUTPUT_N): $(THIS_FILE)
-
-# $(1) == $(INPUT)
-# $(2) == $(OUTPUT)
-$(INC_DIR)_FILES_OUTPUT_N :=
-define n_template =
-$(2): $(1)
-	$$(call quiet_cmd,$(UTILS_DIR)/n.py $(1) $(2),$$(GENERATED_FROM))
-
-$(INC_DIR)_FILES_OUTPUT_N += $(2)
-endef
-
-$(foreach N,$($(INC_DIR)_N_VALUES), \
-  $(foreach T,$($(INC_DIR)_FILES_INPUT_N), \
-    $(eval $(call n_template,$T,$(dir $T)$(subst ntemplate.,,$(subst N,$N,$(notdir $T)))))))
+$(INC_DIR)_FILES_OUTPUT_N := \
+  $(foreach N,$($(INC_DIR)_N_VALUES), \
+    $(foreach T,$($(INC_DIR)_FILES_INPUT_N), \
+      $(dir $T)$(subst ntemplate.,,$(subst N,$N,$(notdir $T)))))
+
+# Every template found above is passed to one run of n.py, which expands each
+# of them for every value and only writes the outputs which changed.
+$(INC_DIR)_N_STAMP := $(TOP_DIR)/.deps/ntemplates/$(patsubst $(TOP_DIR)/%,%,$(INC_DIR)).stamp
+
+$($(INC_DIR)_N_STAMP): N_DIR := $(INC_DIR)
+$($(INC_DIR)_N_STAMP): N_VALUES := $($(INC_DIR)_N_VALUES)
+$($(INC_DIR)_N_STAMP): N_TEMPLATES := $($(INC_DIR)_FILES_INPUT_N)
+$($(INC_DIR)_N_STAMP): $($(INC_DIR)_FILES_INPUT_N) $(INC_FILE) $(UTILS_DIR)/n.py
+	$(MKDIR_TARGET)
+	$(call quiet_cmd,$(UTILS_DIR)/n.py $(N_TEMPLATES) --values $(N_VALUES),Generated $(GREEN)$(words $(N_VALUES))$(NC) copies of the templates in $(YELLOW)$(subst $(TOP_DIR)/,,$(N_DIR))$(NC))
+	@touch $(TARGET)
+
+ifneq (,$(filter-out $(wildcard $($(INC_DIR)_FILES_OUTPUT_N)),$($(INC_DIR)_FILES_OUTPUT_N)))
+$($(INC_DIR)_N_STAMP): ntemplates-missing
+endif
+
+$($(INC_DIR)_FILES_OUTPUT_N): $($(INC_DIR)_N_STAMP) ;
+
+# Outputs which have gone missing get generated again too.
+ntemplates-missing:
+
+.PHONY: ntemplates-missing
 
 TEMPLATES += $($(INC_DIR)_FILES_INPUT_N)
 OUTPUTS   += $($(INC_DIR)_FILES_OUTPUT_N)
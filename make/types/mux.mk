@@ -3,21 +3,18 @@ MUX_GEN_OUTPUTS := \
 	$(INC_DIR)/$(MUX_OUTFILE).pb_type.xml \
 	$(INC_DIR)/$(MUX_OUTFILE).sim.v
 
-MUX_GEN_CMD = $(realpath $(UTILS_DIR)/mux_gen.py)
-MUX_GEN_LIB = $(realpath $(UTILS_DIR)/lib)
-MUX_GEN_FILES = $(wildcard $(MUX_GEN_LIB)/*.py)
-
-$(MUX_GEN_OUTPUTS): $(MUX_GEN_CMD) $(MUX_GEN_LIB) $(MUX_GEN_FILES)
-
 include $(TOP_DIR)/make/mux-args.mk
 
-$(MUX_GEN_OUTPUTS): INC_DIR := $(INC_DIR)
-$(MUX_GEN_OUTPUTS): MUX_GEN_CMD := $(MUX_GEN_CMD)
-$(MUX_GEN_OUTPUTS): MUX_GEN_ARGS := $(MUX_GEN_ARGS)
+# All the muxes are generated together, see make/mux-batch.mk
+MUX_GEN_CONFIGS += $(INC_DIR)
+$(INC_DIR)_MUX_GEN_ARGS := $(MUX_GEN_ARGS)
+
+$(MUX_GEN_STAMP): $(INC_FILE)
 
-$(MUX_GEN_OUTPUTS): $(INC_FILE)
+ifneq (,$(filter-out $(wildcard $(MUX_GEN_OUTPUTS)),$(MUX_GEN_OUTPUTS)))
+$(MUX_GEN_STAMP): mux-missing
+endif
 
-$(MUX_GEN_OUTPUTS):
-	@cd $(INC_DIR); $(MUX_GEN_CMD) $(MUX_GEN_ARGS)
+$(MUX_GEN_OUTPUTS): $(MUX_GEN_STAMP) ;
 
 OUTPUTS += $(MUX_GEN_OUTPUTS)
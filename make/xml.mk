@@ -7,20 +7,35 @@ include make/inc/files.mk
 merged_xml_name = $(dir $(F))$(basename $(notdir $(1))).merged.xml
 MERGE_XML_INPUTS  = $(filter-out %.merged.xml,$(call find_nontemplate_files,*.xml))
 MERGE_XML_OUTPUTS = $(foreach F,$(MERGE_XML_INPUTS),$(call merged_xml_name,$(F)))
-MERGE_XML_XSL     := $(abspath $(TOP_DIR)/common/xml/xmlsort.xsl)
-MERGE_XML_ARGS    := --nomkdir --nonet --xinclude
 
 $(call add_generated_files,$(MERGE_XML_OUTPUTS))
 
-$(foreach F,$(MERGE_XML_INPUTS),$(eval $(call _deps_expand_rule,$(call merged_xml_name,$(F)),$(call depend_on_all,$(F)))))
+# All the XML files are merged by one run of merge_xml.py, so the files they
+# share are only read once. The tool remembers a hash of everything each
+# output was merged from, and only merges the outputs whose hash changed
+# (reusing the normalised trees of any includes which didn't), rewriting them
+# only when they change. The stamp is checked when a .d file changes (the
+# contents of an XML file or anything it includes changed, not just touched).
+MERGE_XML_TOOL := $(UTILS_DIR)/merge_xml.py
+MERGE_XML_TOOL_FILES := $(MERGE_XML_TOOL) $(UTILS_DIR)/lib/xmlmerge.py
 
-$(MERGE_XML_OUTPUTS):
-	$(call quiet_cmd,$(XSLT) $(MERGE_XML_ARGS) --output $(TARGET) $(MERGE_XML_XSL) $(PREREQ_FIRST),$(GENERATED_FROM))
+MERGE_XML_STAMP := $(TOP_DIR)/.deps/merged.xml.stamp
+MERGE_XML_DEPS = $(foreach F,$(MERGE_XML_INPUTS),$(call depend_on_deps,$(F)))
 
-# Depend on the XSL script.
-$(MERGE_XML_OUTPUTS): $(MERGE_XML_XSL)
-# Depend on this Makefile (and it's deps)
-#$(MERGE_XML_OUTPUTS): %.merged.xml: $(call ALL,$(INC_MAKEFILE))
+# Outputs which have gone missing get merged again too.
+MERGE_XML_MISSING := $(filter-out $(wildcard $(MERGE_XML_OUTPUTS)),$(MERGE_XML_OUTPUTS))
+
+$(MERGE_XML_STAMP): $(MERGE_XML_DEPS) $(MERGE_XML_TOOL_FILES) $(if $(MERGE_XML_MISSING),merged-missing) | $(TOP_DIR)/.deps
+	$(file >$(TARGET).list,$(MERGE_XML_INPUTS))
+	$(call quiet_cmd,$(MERGE_XML_TOOL) --verbose --files-from $(TARGET).list,Merged XML files)
+	@touch $(TARGET)
+
+$(MERGE_XML_OUTPUTS): $(MERGE_XML_STAMP) ;
+
+merged-missing:
+	@true
+
+.PHONY: merged-missing
 
 merged: $(filter $(FILTER_PATH)%,$(MERGE_XML_OUTPUTS))
 	$(call heading,Merged output XML files)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Generate a Makefile fragment with the flattened include dependencies of many
+files.
+
+The `.d` stamp of each file is made to depend directly on every file it
+transitively includes, see make/deps.mk.
+"""
+
+import argparse
+import sys
+
+from lib.deps import DependencyGraph
+from lib.deps import read_inputs
+from lib.outputs import write_if_changed
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "inputfiles",
+    nargs="*",
+    help="Input Verilog and XML files")
+parser.add_argument(
+    "--files-from",
+    help="File containing a list of input files, '-' for stdin")
+parser.add_argument(
+    "--output", "-o",
+    required=True,
+    help="Makefile fragment to write, only written if it changed")
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    graph = DependencyGraph(read_inputs(args.inputfiles, args.files_from))
+    for missing in graph.missing():
+        print("File {} is missing! (and no generation rule either!)".format(missing), file=sys.stderr)
+
+    if write_if_changed(args.output, graph.makefile()):
+        print("Generated dependency graph", args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
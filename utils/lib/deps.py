@@ -5,13 +5,15 @@ This file needs to be kept in sync with ../../make/deps.mk
 
 import os
 import os.path
+import sys
+
+from lib.includes import default_graph
 
 MY_DIR = os.path.dirname(os.path.abspath(__file__))
 TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
 
 DEPS_DIR=".deps"
 DEPS_EXT=".d"
-DEPMK_EXT=".dmk"
 
 
 def makefile_dir(filepath):
@@ -91,39 +93,168 @@ def deps_dir(filepath, *, top_dir=TOP_DIR):
     )
 
 
-def deps_makefile(filepath, *, top_dir=TOP_DIR):
-    """Get deps makefile name.
+def read_inputs(inputfiles, files_from):
+    """Return the list of input files given on the command line, followed by
+    any listed (whitespace separated) in the file files_from. A files_from of
+    '-' reads the list from stdin.
+
+    >>> import io, sys
+    >>> stdin, sys.stdin = sys.stdin, io.StringIO("c.v\\nd.v e.v\\n")
+    >>> read_inputs(["a.v", "b.v"], "-")
+    ['a.v', 'b.v', 'c.v', 'd.v', 'e.v']
+    >>> sys.stdin = stdin
+    """
+    inputs = list(inputfiles)
+    if files_from == "-":
+        inputs.extend(sys.stdin.read().split())
+    elif files_from is not None:
+        with open(files_from, "r") as f:
+            inputs.extend(f.read().split())
+    return inputs
 
-    Python version of `$(call deps_makefile,{})` in make/deps.mk
 
-    >>> td = os.path.abspath(os.curdir)
-    >>> deps_makefile("./a/blah", top_dir=td)
-    '.deps/a/blah.dmk'
-    >>> deps_makefile("blah", top_dir=td)
-    '.deps/blah.dmk'
+def deps_stamp(filepath, *, top_dir=TOP_DIR):
+    """Get the absolute path of the .d stamp file for a file.
+
+    Python version of `$(call depend_on_deps,{})` in make/deps.mk
+
+    >>> deps_stamp("/abc3/a/blah", top_dir="/abc3")
+    '/abc3/.deps/a/blah.d'
+    """
+    return os.path.join(top_dir, deps_dir(filepath, top_dir=top_dir) + DEPS_EXT)
+
+
+class DependencyGraph:
+    """The flattened dependencies between a set of files.
+
+    Every file depends on everything it transitively includes, so make can be
+    given one rule per file rather than having to walk a chain of `.d` files.
+
+    Inputs
+    -------
+    files : list of all the files which exist, or can be generated
+    graph : `lib.includes.IncludeGraph` to find the includes with
+
+    >>> import shutil, tempfile
+    >>> from lib.includes import IncludeGraph
+    >>> d = tempfile.mkdtemp()
+    >>> for name, text in [("a.v", '`include "b.v"'), ("b.v", '`include "c.v"'), ("c.v", ""),
+    ...                    ("d.xml", '<xi:include href="e.xml"/>')]:
+    ...     with open(os.path.join(d, name), "w") as f:
+    ...         _ = f.write(text)
+    >>> g = DependencyGraph([os.path.join(d, n) for n in ("a.v", "b.v", "c.v", "d.xml")],
+    ...                     IncludeGraph(cache_path=None))
+    >>> [os.path.basename(p) for p in g.closure(os.path.join(d, "a.v"))]
+    ['b.v', 'c.v']
+    >>> [os.path.relpath(p, d) for p in g.missing()]
+    ['e.xml']
+    >>> print(g.makefile(top_dir=d).replace(d, "T"), end="")
+    T/.deps/a.v.d: T/b.v T/c.v
+    T/.deps/b.v.d: T/c.v
+    >>> shutil.rmtree(d)
+    """
+
+    def __init__(self, files, graph=None):
+        self.files = sorted(set(os.path.abspath(f) for f in files))
+        self.possible = set(self.files)
+        self.graph = graph or default_graph()
+        self._closures = {}
+
+    def includes(self, filepath):
+        """Includes of a file which exist (or can be generated)."""
+        return [f for f in self.graph.includes(filepath) if self.exists(f)]
+
+    def exists(self, filepath):
+        return filepath in self.possible or os.path.exists(filepath)
+
+    def closure(self, filepath):
+        """Return the sorted list of files a file transitively includes."""
+        filepath = os.path.abspath(filepath)
+        if filepath not in self._closures:
+            # Guard against include loops
+            self._closures[filepath] = []
+            deps = set()
+            for inc in self.includes(filepath):
+                deps.add(inc)
+                deps.update(self.closure(inc))
+            deps.discard(filepath)
+            self._closures[filepath] = sorted(deps)
+        return self._closures[filepath]
+
+    def missing(self):
+        """Return the sorted list of included files which don't exist and
+        can't be generated."""
+        missing = set()
+        for f in self.files:
+            for inc in self.graph.includes(f):
+                if not self.exists(inc):
+                    missing.add(inc)
+        return sorted(missing)
+
+    def makefile(self, *, top_dir=TOP_DIR):
+        """Return a makefile fragment making the `.d` stamp of each file
+        depend on everything the file transitively includes."""
+        lines = []
+        for f in self.files:
+            deps = self.closure(f)
+            if deps:
+                lines.append("{}: {}".format(deps_stamp(f, top_dir=top_dir), " ".join(deps)))
+        return "".join(l + "\n" for l in lines)
+
+
+def update_deps_stamps(files, graph, changed, db, *, top_dir=TOP_DIR):
+    """Update the `.d` stamps of many files. Each stamp holds a hash of the
+    contents of the file and everything it includes (see `lib.stamps`), and
+    is only rewritten when that hash changes.
+
+    Only the stamps which are missing, or whose file is or includes one of the
+    changed files, are checked. Returns the list of stamps written.
+
+    Inputs
+    -------
+    files : list of the files to update the stamps of
+    graph : `DependencyGraph` of the files whose includes are followed
+    changed : list of the files which changed since the last update
+    db : `lib.stamps.StampDB` to hash the files with
+
+    >>> import shutil, tempfile
+    >>> from lib.includes import IncludeGraph
+    >>> from lib.stamps import StampDB
+    >>> d = tempfile.mkdtemp()
+    >>> def write(name, text):
+    ...     with open(os.path.join(d, name), "w") as f:
+    ...         _ = f.write(text)
+    >>> for name, text in [("a.v", '`include "b.v"'), ("b.v", ""), ("c.txt", "")]:
+    ...     write(name, text)
+    >>> files = [os.path.join(d, n) for n in ("a.v", "b.v", "c.txt")]
+    >>> def update(changed):
+    ...     graph = DependencyGraph(files[:2], IncludeGraph(cache_path=None))
+    ...     stamps = update_deps_stamps(files, graph, [os.path.join(d, n) for n in changed],
+    ...                                 StampDB(path=None), top_dir=d)
+    ...     return [os.path.relpath(s, d) for s in stamps]
+    >>> update([])
+    ['.deps/a.v.d', '.deps/b.v.d', '.deps/c.txt.d']
+    >>> write("b.v", "// changed")
+    >>> update(["b.v"])
+    ['.deps/a.v.d', '.deps/b.v.d']
+    >>> os.utime(os.path.join(d, "c.txt"))
+    >>> update(["c.txt"])
+    []
+    >>> shutil.rmtree(d)
     """
-    return deps_dir("{dir}{notdir}{ext}".format(
-        dir=makefile_dir(filepath),
-        notdir=makefile_notdir(filepath),
-        ext=DEPMK_EXT,
-    ), top_dir=top_dir)
-
-
-def add_dependency(f, from_file, on_file):
-    """Record a dependency from file on file."""
-    f.write("""
-$(call add_dependency,{from_file},{on_file})
-""".format(
-    from_file=from_file,
-    on_file=on_file,
-))
-
-
-def write_deps(inputfile_name, data):
-    deps_filename = deps_makefile(inputfile_name)
-    with open(deps_filename, "w") as f:
-        f.write(data.getvalue())
-    print("Generated dependency info", deps_filename)
+    changed = set(os.path.abspath(f) for f in changed)
+    graph_files = set(graph.files)
+    written = []
+    for f in sorted(set(os.path.abspath(f) for f in files)):
+        inputs = [f]
+        if f in graph_files:
+            inputs += graph.closure(f)
+        stamp = deps_stamp(f, top_dir=top_dir)
+        if os.path.exists(stamp) and changed.isdisjoint(inputs):
+            continue
+        if db.update(stamp, inputs):
+            written.append(stamp)
+    return written
 
 
 if __name__ == "__main__":
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Index of the source files in the repo.
+
+In a git checkout the files are listed by `git ls-files`, which reads the git
+index rather than walking the tree. Otherwise the tree is walked, keeping a
+manifest which records, for each directory, its modification time and the
+(non-excluded) files and directories in it. A directory's modification time
+changes whenever an entry is added to, removed from or renamed in it, so
+updating the index only needs to re-read the directories which changed since
+the last run.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
+
+DEFAULT_MANIFEST = os.path.join(TOP_DIR, ".deps", "files.json")
+
+# Bump when the format of the manifest changes.
+MANIFEST_VERSION = 1
+
+
+def read_excludes(path=os.path.join(TOP_DIR, ".excludes")):
+    """Read the exclude patterns from an excludes file, ignoring comments and
+    empty lines."""
+    exclude_patterns = []
+    with open(path, "r") as exclude_file:
+        for line in exclude_file:
+            # Strip comments
+            if '#' in line:
+                line = line[:line.find('#')]
+
+            # Strip whitespace
+            line = line.strip()
+
+            # Skip empty lines
+            if not line:
+                continue
+
+            exclude_patterns.append(line)
+    return exclude_patterns
+
+
+def glob_regex(pattern):
+    """Convert a glob into a regex, in the same way as `glob2regex` in
+    make/inc/files.mk. `*` matches within a directory, `**` matches across
+    directories and the pattern only needs to match the end of a path.
+
+    >>> bool(glob_regex("/a/*.v").search("/a/b.v"))
+    True
+    >>> bool(glob_regex("/a/*.v").search("/a/b/c.v"))
+    False
+    >>> bool(glob_regex("/a/**.v").search("/a/b/c.v"))
+    True
+    >>> bool(glob_regex("*.xml").search("/a/b/c.xml"))
+    True
+    """
+    regex = pattern.replace(".", "\\.").replace("*", "[^/]*").replace("[^/]*[^/]*", ".*")
+    return re.compile(regex + "$")
+
+
+def exclude_regex(patterns):
+    """Compile a list of fnmatch patterns into one regex matching a name.
+
+    >>> r = exclude_regex(["*.d", ".*", "third_party"])
+    >>> [n for n in ("a.d", ".git", "third_party", "a.v", "third_party2") if r.match(n)]
+    ['a.d', '.git', 'third_party']
+    """
+    if not patterns:
+        return re.compile(r"(?!)")
+    return re.compile("|".join("(?:{})".format(fnmatch.translate(p)) for p in patterns))
+
+
+class FileIndex:
+    """Index of the files below some directories, excluding any file or
+    directory whose name matches one of the exclude patterns.
+
+    >>> d = tempfile.mkdtemp()
+    >>> for name in ("a.v", "b.xml", "sub/c.v", "unused/d.v"):
+    ...     os.makedirs(os.path.dirname(os.path.join(d, name)), exist_ok=True)
+    ...     open(os.path.join(d, name), "w").close()
+    >>> index = FileIndex([d], ["*unused*"], manifest_path=None)
+    >>> [os.path.relpath(f, d) for f in index.files()]
+    ['a.v', 'b.xml', 'sub/c.v']
+    >>> [os.path.relpath(f, d) for f in index.dirs()]
+    ['sub']
+    >>> [os.path.relpath(f, d) for f in index.query(d + "/*.v")]
+    ['a.v']
+    >>> import shutil; shutil.rmtree(d)
+    """
+
+    def __init__(self, roots, exclude_patterns, manifest_path=DEFAULT_MANIFEST, log=None, use_git=False):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.exclude_patterns = list(exclude_patterns)
+        self.exclude_re = exclude_regex(self.exclude_patterns)
+        self.manifest_path = manifest_path
+        self.log = log or (lambda *args, **kw: None)
+        self.use_git = use_git
+        self.manifest = {}
+        self.changed = False
+        if manifest_path is not None:
+            self.manifest = self._load(manifest_path, self.exclude_patterns)
+        self._files = None
+        self._dirs = None
+
+    @staticmethod
+    def _load(path, exclude_patterns):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != MANIFEST_VERSION:
+            return {}
+        # Different excludes means different contents for every directory.
+        if data.get("excludes") != exclude_patterns:
+            return {}
+        return data.get("dirs", {})
+
+    def excluded(self, name):
+        return self.exclude_re.match(name) is not None
+
+    def _scan(self, path, mtime):
+        """Read a directory and record its contents in the manifest."""
+        files = []
+        dirs = []
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            isdir = entry.is_dir()
+            if self.excluded(entry.name):
+                self.log(" -dir" if isdir else "-file", os.path.normpath(entry.path))
+                continue
+            if isdir:
+                # Like os.walk, symlinks to directories aren't followed.
+                if not entry.is_symlink():
+                    dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+        self.manifest[path] = {"mtime": mtime, "files": files, "dirs": dirs}
+        self.changed = True
+
+    def _walk(self, path, seen, files, dirs):
+        """Walk the tree below path, adding the files and directories found."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        seen.add(path)
+        entry = self.manifest.get(path)
+        if entry is None or entry["mtime"] != mtime:
+            self._scan(path, mtime)
+            entry = self.manifest[path]
+        for f in entry["files"]:
+            files.append(os.path.join(path, f))
+        for d in entry["dirs"]:
+            subdir = os.path.join(path, d)
+            dirs.append(subdir)
+            self._walk(subdir, seen, files, dirs)
+
+    def _git_ls_files(self, root, *args):
+        output = subprocess.check_output(
+            ["git", "-C", root, "ls-files", "-z"] + list(args),
+            stderr=subprocess.DEVNULL)
+        return [p for p in output.decode("utf-8").split("\0") if p]
+
+    def _git(self, root, seen, files, dirs):
+        """List the files below root using the git index, adding the files and
+        directories found. Raises an exception if root isn't in a git
+        checkout."""
+        cached = self._git_ls_files(root, "--stage")
+        deleted = set(self._git_ls_files(root, "--deleted"))
+        # Untracked files are pruned by git itself.
+        others = self._git_ls_files(
+            root, "--others", *["--exclude={}".format(p) for p in self.exclude_patterns])
+
+        paths = []
+        submodules = []
+        for line in cached:
+            info, path = line.split("\t", 1)
+            mode = info.split(" ", 1)[0]
+            if path in deleted:
+                continue
+            if mode == "160000":
+                submodules.append(path)
+            elif mode == "120000" and os.path.isdir(os.path.join(root, path)):
+                # Like os.walk, symlinks to directories aren't followed.
+                continue
+            else:
+                paths.append(path)
+        paths.extend(others)
+
+        excluded = {}
+        def included(parts):
+            for part in parts:
+                if part not in excluded:
+                    excluded[part] = self.excluded(part)
+                if excluded[part]:
+                    return False
+            return True
+
+        found_dirs = set()
+        for path in paths:
+            parts = path.split("/")
+            if not included(parts):
+                continue
+            files.append(os.path.join(root, path))
+            for i in range(1, len(parts)):
+                found_dirs.add("/".join(parts[:i]))
+        dirs.extend(os.path.join(root, d) for d in found_dirs)
+
+        # Git doesn't list the contents of submodules.
+        for path in submodules:
+            parts = path.split("/")
+            if not included(parts):
+                continue
+            subdir = os.path.join(root, path)
+            for i in range(1, len(parts) + 1):
+                dirs.append(os.path.join(root, "/".join(parts[:i])))
+            self._walk(subdir, seen, files, dirs)
+
+    def update(self):
+        """Bring the index up to date with the file system, only re-reading
+        directories which changed."""
+        files = []
+        dirs = []
+        seen = set()
+        for root in self.roots:
+            self.log("Looking in:", root)
+            if self.use_git:
+                try:
+                    self._git(root, seen, files, dirs)
+                    continue
+                except (OSError, subprocess.CalledProcessError):
+                    self.log("Not a git checkout, walking:", root)
+            self._walk(root, seen, files, dirs)
+        # Forget directories which no longer exist (or are now excluded).
+        for path in list(self.manifest):
+            if path not in seen and any(path == r or path.startswith(r + "/") for r in self.roots):
+                del self.manifest[path]
+                self.changed = True
+        self._files = sorted(set(files))
+        self._dirs = sorted(set(dirs))
+
+    def files(self):
+        """Return the sorted list of all files in the index."""
+        if self._files is None:
+            self.update()
+        return self._files
+
+    def dirs(self):
+        """Return the sorted list of all directories in the index, not
+        including the top level directories."""
+        if self._dirs is None:
+            self.update()
+        return self._dirs
+
+    def query(self, pattern):
+        """Return the sorted list of files matching a glob, see `glob_regex`."""
+        regex = glob_regex(pattern)
+        return [f for f in self.files() if regex.search(f)]
+
+    def save(self):
+        """Write the manifest, if anything changed."""
+        if self.manifest_path is None or not self.changed:
+            return
+        manifest_dir = os.path.dirname(self.manifest_path)
+        os.makedirs(manifest_dir, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=manifest_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "excludes": self.exclude_patterns,
+                "dirs": self.manifest,
+            }, f)
+        os.replace(tmppath, self.manifest_path)
+        self.changed = False
+
+
+def make_fragment(variables):
+    """Return a makefile fragment setting each variable to a list of files.
+
+    >>> print(make_fragment([("A", ["/x/a", "/x/b"]), ("B", [])]), end="")
+    A := \\
+        /x/a \\
+        /x/b \\
+    <BLANKLINE>
+    B := \\
+    <BLANKLINE>
+    """
+    lines = []
+    for name, files in variables:
+        lines.append("{} := \\".format(name))
+        for f in files:
+            lines.append("    {} \\".format(f))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Resolve the files included by Verilog (`` `include``) and XML (`xi:include`)
+files.
+
+Each file is only parsed once; the includes found are cached on disk keyed on
+the file's modification time and size, falling back to a hash of its contents
+when those change, so no-op rebuilds don't need to re-read every file.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
+
+DEFAULT_CACHE = os.path.join(TOP_DIR, ".deps", "includes.json")
+
+# Bump when the format of the cache changes.
+CACHE_VERSION = 1
+
+verilog_include = re.compile(r'^\s*`include\s+"([^"]+)"', re.MULTILINE)
+xml_include = re.compile(r'<xi:include[^>]*href="([^"]*)"', re.IGNORECASE)
+
+
+def parse_verilog(text):
+    """Return the files included by Verilog source, in order.
+
+    >>> parse_verilog('`include "a.v"\\n  `include "../b/b.v"\\n// `include "c.v"\\n')
+    ['a.v', '../b/b.v']
+    """
+    return verilog_include.findall(text)
+
+
+def parse_xml(text):
+    """Return the files included by XML source, in order.
+
+    >>> parse_xml('<a><xi:include href="b.xml"/><xi:include xpointer="x" href="c.xml"/></a>')
+    ['b.xml', 'c.xml']
+    """
+    return xml_include.findall(text)
+
+
+def parser_for(path):
+    """Return the function to parse the includes of a file, based on its
+    extension."""
+    if path.endswith(".xml"):
+        return parse_xml
+    return parse_verilog
+
+
+class IncludeGraph:
+    """Graph of the files included by other files.
+
+    Paths returned are absolute, with includes resolved relative to the
+    directory of the including file.
+
+    >>> d = tempfile.mkdtemp()
+    >>> for name, text in [("a.v", '`include "b.v"\\n`include "c.v"'), ("b.v", '`include "c.v"'), ("c.v", "")]:
+    ...     with open(os.path.join(d, name), "w") as f:
+    ...         _ = f.write(text)
+    >>> g = IncludeGraph(cache_path=None)
+    >>> [os.path.basename(p) for p in g.includes(os.path.join(d, "a.v"))]
+    ['b.v', 'c.v']
+    >>> [os.path.basename(p) for p in g.closure([os.path.join(d, "b.v")])]
+    ['c.v']
+    >>> import shutil; shutil.rmtree(d)
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = set()
+        if cache_path is not None:
+            self.entries = self._load(cache_path)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != CACHE_VERSION:
+            return {}
+        return data.get("files", {})
+
+    def includes(self, path):
+        """Return the list of files directly included by a file, in the
+        order they are included. Missing files include nothing."""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return []
+
+        entry = self.entries.get(path)
+        if entry is not None and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            return entry["includes"]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry["hash"] == digest:
+            includes = entry["includes"]
+        else:
+            dirname = os.path.dirname(path)
+            includes = [
+                os.path.normpath(os.path.join(dirname, inc))
+                for inc in parser_for(path)(data.decode("utf-8", errors="replace"))
+            ]
+
+        self.entries[path] = {
+            "mtime": st.st_mtime_ns,
+            "size": st.st_size,
+            "hash": digest,
+            "includes": includes,
+        }
+        self.dirty.add(path)
+        return includes
+
+    def content_hash(self, path):
+        """Return the SHA256 hash of the contents of a file, or None if it is
+        missing."""
+        path = os.path.abspath(path)
+        self.includes(path)
+        entry = self.entries.get(path)
+        if entry is None or not os.path.exists(path):
+            return None
+        return entry["hash"]
+
+    def closure(self, paths):
+        """Return the sorted list of files transitively included by the given
+        files."""
+        seen = set()
+        todo = [os.path.abspath(p) for p in paths]
+        while todo:
+            for inc in self.includes(todo.pop()):
+                if inc not in seen:
+                    seen.add(inc)
+                    todo.append(inc)
+        return sorted(seen)
+
+    def save(self):
+        """Write any newly parsed files to the cache. Entries written by other
+        processes since the cache was loaded are kept."""
+        if self.cache_path is None or not self.dirty:
+            return
+        entries = self._load(self.cache_path)
+        for path in self.dirty:
+            entries[path] = self.entries[path]
+
+        cache_dir = os.path.dirname(self.cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CACHE_VERSION, "files": entries}, f)
+        os.replace(tmppath, self.cache_path)
+        self.dirty = set()
+
+
+_default_graph = None
+
+
+def default_graph():
+    """Return an IncludeGraph using the shared on-disk cache, which is saved
+    when the program exits."""
+    global _default_graph
+    if _default_graph is None:
+        _default_graph = IncludeGraph()
+        atexit.register(_default_graph.save)
+    return _default_graph
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,3 +1,5 @@
+import copy
+import functools
 import lxml.etree as ET
 from enum import Enum
 
@@ -26,6 +28,47 @@ def clog2(x):
     return i
 
 
+# Delay through a MUX2, in picoseconds.
+MUX2_DELAY_PS = 10
+
+
+def delay_str(stages):
+    """The delay through a number of MUX2s, as a VPR time.
+
+    >>> delay_str(1), delay_str(3)
+    ('10e-12', '30e-12')
+    """
+    return "%ie-12" % (stages * MUX2_DELAY_PS)
+
+
+def mux_tree(width):
+    """Plan a balanced tree of MUX4s for a mux with width inputs, with a MUX2
+    at the root when the number of select bits is odd.
+
+    Returns a list of (mux width, first select bit) for each level, starting
+    with the level connected to the inputs. Each level uses the select bits
+    after the ones used by the levels before it, so the least significant
+    bits pick between the inputs.
+
+    >>> mux_tree(2)
+    [(2, 0)]
+    >>> mux_tree(4)
+    [(4, 0)]
+    >>> mux_tree(8)
+    [(4, 0), (2, 2)]
+    >>> mux_tree(30)
+    [(4, 0), (4, 2), (2, 4)]
+    """
+    assert width >= 2, width
+    bits = clog2(width)
+    levels = []
+    for first_bit in range(0, bits - 1, 2):
+        levels.append((4, first_bit))
+    if bits % 2:
+        levels.append((2, bits - 1))
+    return levels
+
+
 class MuxType(Enum):
     LOGIC   = 'BEL_MX'
     ROUTING = 'BEL_RX'
@@ -56,37 +99,14 @@ class MuxPinType(Enum):
         return self.value
 
 
-def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
-    """Generate <pb_type> XML for a mux.
-
-    Parameters
-    ----------
-    mux_type: MuxType
-        Type of mux to create.
-
-    mux_name: str
-        Name of the mux.
-
-    pins: [(MuxPinType, str, int, int),]
-        List of tuples which contain (pin type, pin name, port width, index)
-
-    subckt: str
-        Name of the blif_model for the mux. Only valid when mux_type ==
-        MuxType.LOGIC.
+def _full_mux_name(mux_type, mux_name):
+    """Add the BEL_MX- or BEL_RX- prefix to a mux name if it doesn't have one.
 
-    num_pb: int
-        Value for the num_pb value. Defaults to 1.
-
-    comment: str
-        Optional comment for the mux.
-
-    Returns
-    -------
-    xml.etree.ElementTree
-        pb_type.xml for requested mux
+    >>> _full_mux_name(MuxType.ROUTING, "A")
+    'BEL_RX-A'
+    >>> _full_mux_name(MuxType.LOGIC, "BEL_MX-A")
+    'BEL_MX-A'
     """
-    assert isinstance(comment, str), "{} {}".format(type(comment), repr(comment))
-
     if mux_type == MuxType.LOGIC:
         if '-' not in mux_name:
             mux_name = 'BEL_MX-'+mux_name
@@ -99,7 +119,37 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
             assert mux_name.startswith('BEL_RX-'), "Provided mux name has type {} but not BEL_MX!".format(mux_name)
     else:
         assert False, "Unknown type {}".format(mux_type)
+    return mux_name
+
 
+def _pin_delays(pins):
+    """The number of MUX2s between each bit of the inputs and selects of a
+    mux built as a tree (see mux_tree) and its output.
+
+    >>> pins = [
+    ...     (MuxPinType.INPUT, "I", 8, '[7:0]'),
+    ...     (MuxPinType.SELECT, "S0", 1, '[0]'),
+    ...     (MuxPinType.SELECT, "S1", 2, '[2:1]'),
+    ...     (MuxPinType.OUTPUT, "O", 1, ''),
+    ... ]
+    >>> _pin_delays(pins)
+    {'I': [3, 3, 3, 3, 3, 3, 3, 3], 'S0': [3], 'S1': [2, 1]}
+    """
+    bits = clog2(sum(w for t, _, w, _ in pins if t == MuxPinType.INPUT))
+    delays = {}
+    select_bit = 0
+    for pin_type, pin_name, pin_width, _ in pins:
+        if pin_type == MuxPinType.INPUT:
+            delays[pin_name] = [bits] * pin_width
+        elif pin_type == MuxPinType.SELECT:
+            delays[pin_name] = [bits - b for b in range(select_bit, select_bit + pin_width)]
+            select_bit += pin_width
+    return delays
+
+
+def _build_pb_type_xml(mux_type, mux_name, pins, subckt, num_pb, comment, tree=False):
+    """Build the <pb_type> XML for a mux from scratch. mux_name must already
+    have its prefix."""
     pb_type_xml = ET.Element(
         'pb_type', {
             'name': mux_name,
@@ -108,8 +158,6 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
 
     if mux_type == MuxType.LOGIC:
         pb_type_xml.attrib['blif_model'] = '.subckt %s' % subckt
-    else:
-        assert not subckt, "Provided subckt={} for non-logic mux!".format(subckt)
 
     if comment is not None:
         pb_type_xml.append(ET.Comment(comment))
@@ -125,7 +173,25 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
             {'name': pin_name, 'num_pins': str(pin_width)},
         )
 
-    if mux_type == MuxType.LOGIC:
+    if mux_type == MuxType.LOGIC and tree:
+        delays = _pin_delays(pins)
+        opin_names = [n for t, n, _, _ in pins if t in (MuxPinType.OUTPUT,)]
+        for ipin_type, ipin_name, ipin_width, ipin_index in pins:
+            if ipin_type not in (MuxPinType.INPUT, MuxPinType.SELECT):
+                continue
+
+            for opin_name in opin_names:
+                delay_matrix = ET.SubElement(
+                    pb_type_xml,
+                    'delay_matrix', {
+                        'type': "max",
+                        'in_port': "%s.%s" % (mux_name, ipin_name),
+                        'out_port': "%s.%s" % (mux_name, opin_name),
+                    },
+                )
+                delay_matrix.text = "".join(
+                    "\n" + delay_str(d) for d in delays[ipin_name]) + "\n"
+    elif mux_type == MuxType.LOGIC:
         for ipin_type, ipin_name, ipin_width, ipin_index in pins:
             if ipin_type not in (MuxPinType.INPUT, MuxPinType.SELECT):
                 continue
@@ -137,7 +203,7 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
                 ET.SubElement(
                     pb_type_xml,
                     'delay_constant', {
-                        'max': "10e-12",
+                        'max': delay_str(1),
                         'in_port': "%s.%s" % (mux_name, ipin_name),
                         'out_port': "%s.%s" % (mux_name, opin_name),
                     },
@@ -149,7 +215,7 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
         outputs = ["{}.{}".format(mux_name, n) for t, n, _, _ in pins if t in (MuxPinType.OUTPUT,)]
         assert len(outputs) == 1
 
-        ET.SubElement(
+        mux = ET.SubElement(
             interconnect,
             'mux', {
                 'name': '%s' % (mux_name,),
@@ -157,7 +223,137 @@ def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment=""):
                 'output': outputs[0],
             },
         )
+        if tree:
+            # Every input bit goes through the same number of MUX2s.
+            input_bits = sum(w for t, _, w, _ in pins if t == MuxPinType.INPUT)
+            ET.SubElement(
+                mux,
+                'delay_constant', {
+                    'max': delay_str(clog2(input_bits)),
+                    'in_port': " ".join(inputs),
+                    'out_port': outputs[0],
+                },
+            )
+
+    return pb_type_xml
+
+
+@functools.lru_cache(maxsize=None)
+def _pb_type_template(mux_type, shape, num_pb, tree):
+    """Build the <pb_type> XML for every mux with the given pin types and
+    widths once.
+
+    The names in the template are format fields; {0} is the mux name, {1} the
+    subckt and {2}, {3}, ... the pin names. Returns the template, a list of
+    (element index, attribute, format string) for the attributes which need
+    filling in, and the index of the comment.
+    """
+    pins = [(t, "{%i}" % (i+2), w, 0) for i, (t, w) in enumerate(shape)]
+    template = _build_pb_type_xml(
+        mux_type, "{0}", pins, "{1}", num_pb, "", tree)
+
+    fields = []
+    comment_index = None
+    for i, elem in enumerate(template.iter()):
+        if elem.tag is ET.Comment:
+            comment_index = i
+            continue
+        for attr, value in elem.items():
+            if "{" in value:
+                fields.append((i, attr, value))
+    return template, fields, comment_index
+
+
+def pb_type_xml(mux_type, mux_name, pins, subckt=None, num_pb=1, comment="", tree=False):
+    """Generate <pb_type> XML for a mux.
+
+    Muxes with the same pin types and widths only differ in their names, so
+    the XML for each shape of mux is built once and copied, with the names
+    filled in.
+
+    Parameters
+    ----------
+    mux_type: MuxType
+        Type of mux to create.
+
+    mux_name: str
+        Name of the mux.
+
+    pins: [(MuxPinType, str, int, int),]
+        List of tuples which contain (pin type, pin name, port width, index)
+
+    subckt: str
+        Name of the blif_model for the mux. Only valid when mux_type ==
+        MuxType.LOGIC.
+
+    num_pb: int
+        Value for the num_pb value. Defaults to 1.
+
+    comment: str
+        Optional comment for the mux.
+
+    tree: bool
+        The mux is simulated as a tree of MUX4s and MUX2s (see mux_tree), so
+        give each input and select bit the delay of the MUX2s it goes through,
+        rather than one delay for every input.
+
+    Returns
+    -------
+    xml.etree.ElementTree
+        pb_type.xml for requested mux
+
+    >>> pins = [
+    ...     (MuxPinType.INPUT, "A", 1, 0),
+    ...     (MuxPinType.INPUT, "B", 1, 0),
+    ...     (MuxPinType.OUTPUT, "O", 1, 0),
+    ... ]
+    >>> print(ET.tostring(pb_type_xml(MuxType.ROUTING, "M", pins)).decode())
+    <pb_type name="BEL_RX-M" num_pb="1"><!----><input name="A" num_pins="1"/><input name="B" num_pins="1"/><output name="O" num_pins="1"/><interconnect><mux name="BEL_RX-M" input="BEL_RX-M.A BEL_RX-M.B" output="BEL_RX-M.O"/></interconnect></pb_type>
+    >>> pins = [
+    ...     (MuxPinType.INPUT, "I", 10, '[9:0]'),
+    ...     (MuxPinType.SELECT, "S", 4, '[3:0]'),
+    ...     (MuxPinType.OUTPUT, "O", 1, ''),
+    ... ]
+    >>> print(ET.tostring(pb_type_xml(MuxType.ROUTING, "M", pins, tree=True)).decode())
+    <pb_type name="BEL_RX-M" num_pb="1"><!----><input name="I" num_pins="10"/><output name="O" num_pins="1"/><interconnect><mux name="BEL_RX-M" input="BEL_RX-M.I" output="BEL_RX-M.O"><delay_constant max="40e-12" in_port="BEL_RX-M.I" out_port="BEL_RX-M.O"/></mux></interconnect></pb_type>
+    >>> pins = [
+    ...     (MuxPinType.INPUT, "I", 2, '[1:0]'),
+    ...     (MuxPinType.SELECT, "S", 1, '[0:0]'),
+    ...     (MuxPinType.OUTPUT, "O", 1, ''),
+    ... ]
+    >>> args = (MuxType.LOGIC, "M", pins, "MUX2", 1, " c ")
+    >>> a = ET.tostring(pb_type_xml(*args))
+    >>> a == ET.tostring(_build_pb_type_xml(*args[:1], "BEL_MX-M", *args[2:]))
+    True
+    >>> print(a.decode())
+    <pb_type name="BEL_MX-M" num_pb="1" blif_model=".subckt MUX2"><!-- c --><input name="I" num_pins="2"/><input name="S" num_pins="1"/><output name="O" num_pins="1"/><delay_constant max="10e-12" in_port="BEL_MX-M.I" out_port="BEL_MX-M.O"/><delay_constant max="10e-12" in_port="BEL_MX-M.S" out_port="BEL_MX-M.O"/></pb_type>
+    >>> print(ET.tostring(pb_type_xml(*args, tree=True)).decode())
+    <pb_type name="BEL_MX-M" num_pb="1" blif_model=".subckt MUX2"><!-- c --><input name="I" num_pins="2"/><input name="S" num_pins="1"/><output name="O" num_pins="1"/><delay_matrix type="max" in_port="BEL_MX-M.I" out_port="BEL_MX-M.O">
+    10e-12
+    10e-12
+    </delay_matrix><delay_matrix type="max" in_port="BEL_MX-M.S" out_port="BEL_MX-M.O">
+    10e-12
+    </delay_matrix></pb_type>
+    """
+    assert isinstance(comment, str), "{} {}".format(type(comment), repr(comment))
+
+    mux_name = _full_mux_name(mux_type, mux_name)
+    if mux_type != MuxType.LOGIC:
+        assert not subckt, "Provided subckt={} for non-logic mux!".format(subckt)
 
+    template, fields, comment_index = _pb_type_template(
+        mux_type,
+        tuple((pin_type, pin_width) for pin_type, _, pin_width, _ in pins),
+        num_pb,
+        tree,
+    )
+
+    values = [mux_name, subckt] + [pin_name for _, pin_name, _, _ in pins]
+    pb_type_xml = copy.deepcopy(template)
+    elems = list(pb_type_xml.iter())
+    for i, attr, value in fields:
+        elems[i].set(attr, value.format(*values))
+    elems[comment_index].text = comment
     return pb_type_xml
 
 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Writing generated files.
+
+Generated files are only written when their contents change, so their
+modification times (and so everything make builds from them) only advance
+when something actually changed. When they are written, the new contents go
+to a temporary file in the same directory which is then renamed over the old
+file, so an interrupted or parallel build never sees a half written file.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+# The permissions new files get from open().
+NEW_FILE_MODE = 0o666 & ~_umask()
+
+
+def write_if_changed(path, contents):
+    """Write contents (str or bytes) to a file, unless it already contains
+    them. Returns True if the file was written.
+
+    The contents are compared as bytes (str is encoded as UTF-8), so a change
+    of line endings counts as a change, and the existing file is only read
+    when its size matches.
+
+    >>> d = tempfile.mkdtemp()
+    >>> p = os.path.join(d, "sub", "a.txt")
+    >>> write_if_changed(p, "hello\\n")
+    True
+    >>> write_if_changed(p, "hello\\n")
+    False
+    >>> write_if_changed(p, b"hello\\n")
+    False
+    >>> write_if_changed(p, "hello\\r\\n")
+    True
+    >>> write_if_changed(p, "world\\n")
+    True
+    >>> open(p).read()
+    'world\\n'
+    >>> os.listdir(os.path.dirname(p))
+    ['a.txt']
+    >>> import shutil; shutil.rmtree(d)
+    """
+    if isinstance(contents, str):
+        contents = contents.encode("utf-8")
+    try:
+        st = os.stat(path)
+        if st.st_size == len(contents):
+            with open(path, "rb") as f:
+                if f.read() == contents:
+                    return False
+        file_mode = st.st_mode & 0o7777
+    except FileNotFoundError:
+        file_mode = NEW_FILE_MODE
+
+    outdir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(outdir, exist_ok=True)
+    fd, tmppath = tempfile.mkstemp(
+        dir=outdir, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        os.chmod(tmppath, file_mode)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+    return True
+
+
+@contextlib.contextmanager
+def open_output(path, mode="w"):
+    """Open a generated file for writing. The contents are collected in
+    memory and written with write_if_changed when the block exits without an
+    exception. The returned buffer can still be read with getvalue()
+    afterwards.
+
+    >>> d = tempfile.mkdtemp()
+    >>> p = os.path.join(d, "a.txt")
+    >>> with open_output(p) as f:
+    ...     _ = f.write("hello\\n")
+    >>> f.getvalue()
+    'hello\\n'
+    >>> mtime = os.stat(p).st_mtime_ns
+    >>> with open_output(p) as f:
+    ...     _ = f.write("hello\\n")
+    >>> os.stat(p).st_mtime_ns == mtime
+    True
+    >>> import shutil; shutil.rmtree(d)
+    """
+    assert mode in ("w", "wb"), mode
+    f = io.BytesIO() if "b" in mode else io.StringIO()
+    yield f
+    write_if_changed(path, f.getvalue())
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
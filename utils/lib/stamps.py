@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Content hash based stamp files.
+
+A stamp file contains a hash of the contents of its inputs, and is only
+rewritten (so its modification time only advances) when that hash changes.
+Touching an input without changing it, for example by checking out another
+branch and back, doesn't cause anything depending on the stamp to be rebuilt.
+
+Hashing every input on every check would be slow, so the hash of each file is
+remembered in a database, keyed on the file's modification time and size.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+from lib.outputs import write_if_changed
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
+
+DEFAULT_DB = os.path.join(TOP_DIR, ".deps", "hashes.json")
+
+# Bump when the format of the database changes.
+DB_VERSION = 1
+
+
+class StampDB:
+    """Database of file content hashes.
+
+    >>> d = tempfile.mkdtemp()
+    >>> a, stamp = os.path.join(d, "a"), os.path.join(d, "a.stamp")
+    >>> with open(a, "w") as f:
+    ...     _ = f.write("hello")
+    >>> db = StampDB(path=None)
+    >>> db.update(stamp, [a])
+    True
+    >>> os.utime(a)
+    >>> db.update(stamp, [a])
+    False
+    >>> with open(a, "w") as f:
+    ...     _ = f.write("world")
+    >>> db.update(stamp, [a])
+    True
+    >>> import shutil; shutil.rmtree(d)
+    """
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self.hashes = {}
+        self.dirty = set()
+        if path is not None:
+            self.hashes = self._load(path)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != DB_VERSION:
+            return {}
+        return data.get("files", {})
+
+    def hash(self, filepath):
+        """Return the SHA256 hash of a file's contents, or None if it is
+        missing."""
+        filepath = os.path.abspath(filepath)
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+
+        entry = self.hashes.get(filepath)
+        if entry is not None and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            return entry["hash"]
+
+        h = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.hashes[filepath] = {
+            "mtime": st.st_mtime_ns,
+            "size": st.st_size,
+            "hash": h.hexdigest(),
+        }
+        self.dirty.add(filepath)
+        return h.hexdigest()
+
+    def inputs_hash(self, inputs):
+        """Return one hash covering the names and contents of many files."""
+        h = hashlib.sha256()
+        for filepath in sorted(set(os.path.abspath(f) for f in inputs)):
+            h.update("{}\0{}\0".format(filepath, self.hash(filepath)).encode("utf-8"))
+        return h.hexdigest()
+
+    def update(self, stamp, inputs):
+        """Write the hash of the inputs to a stamp file, unless it already
+        contains it. Returns True if the stamp was written."""
+        return write_if_changed(stamp, self.inputs_hash(inputs) + "\n")
+
+    def save(self):
+        """Write any newly hashed files to the database. Entries written by
+        other processes since the database was loaded are kept; the database
+        is locked while the entries are merged, so runs in parallel don't
+        lose each other's entries."""
+        if self.path is None or not self.dirty:
+            return
+        db_dir = os.path.dirname(self.path)
+        os.makedirs(db_dir, exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            hashes = self._load(self.path)
+            for filepath in self.dirty:
+                hashes[filepath] = self.hashes[filepath]
+
+            fd, tmppath = tempfile.mkstemp(dir=db_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": DB_VERSION, "files": hashes}, f)
+            os.replace(tmppath, self.path)
+        self.dirty = set()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
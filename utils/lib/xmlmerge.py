@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+"""
+Merge XML files, resolving their `xi:include`s.
+
+This does the same job as running `xsltproc --xinclude` with
+`common/xml/xmlsort.xsl`, but in process. Each file is parsed and normalised
+(whitespace only text removed, attributes sorted and their values normalised,
+`xml:base` dropped) once, with its own includes already spliced in, and the
+result is kept. Every later file including it gets a copy of the kept tree
+rather than re-reading and re-sorting it, so merging many files which share
+the same primitives in one run only does the work for each primitive once.
+
+Like `xmlsort.xsl`, only the first `<model>` of each name is kept. Models are
+deduplicated as the trees are built, so a model already seen earlier in a file
+is never copied into it, keeping the trees proportional to the unique content
+rather than to every include chain. Unlike `xmlsort.xsl`, which silently keeps
+the first, a duplicate must be identical to the first model of its name or the
+merge fails. The `<models>` sections of the merged file are then tidied.
+
+Given a cache directory, the normalised trees are also kept between runs. Each
+is stored under a Merkle hash of the file's contents and (recursively) the
+hashes of everything it includes, so a tree is only rebuilt when something in
+it changed; unchanged includes are read back already normalised and with
+their own includes spliced in. The hash each output was merged from is
+remembered too, and outputs whose hash didn't change aren't merged again.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from lxml import etree
+
+from lib.includes import IncludeGraph
+from lib.outputs import write_if_changed
+
+XI_NS = "http://www.w3.org/2001/XInclude"
+XI_INCLUDE = "{%s}include" % XI_NS
+XI_FALLBACK = "{%s}fallback" % XI_NS
+
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+XML_BASE = "{%s}base" % XML_NS
+
+# The whitespace used by XPath's normalize-space() and xsl:strip-space.
+_xml_space = re.compile("[ \t\r\n]+")
+
+HEADER = b'<?xml version="1.0"?>\n'
+
+# Trees cached by a different version of this file can't be trusted.
+with open(__file__, "rb") as f:
+    VERSION = hashlib.sha256(f.read()).hexdigest()
+
+
+class MergeError(Exception):
+    pass
+
+
+def is_blank(text):
+    """Is the text only (XML) whitespace?
+
+    >>> is_blank(" \\n\\t")
+    True
+    >>> is_blank(" a ")
+    False
+    """
+    return not _xml_space.sub("", text)
+
+
+def normalize_space(text):
+    """Python version of the XPath normalize-space() function.
+
+    >>> normalize_space("  a \\n  b ")
+    'a b'
+    """
+    return _xml_space.sub(" ", text).strip(" ")
+
+
+def _attr_name(elem, key):
+    """Return the qualified name of an attribute, which it is sorted by, and
+    its local name, which it is output with."""
+    if not key.startswith("{"):
+        return key, key
+    ns, local = key[1:].split("}", 1)
+    prefix = "xml" if ns == XML_NS else None
+    if prefix is None:
+        for p, uri in elem.nsmap.items():
+            if p and uri == ns:
+                prefix = p
+                break
+    if prefix:
+        return "{}:{}".format(prefix, local), local
+    return local, local
+
+
+def normalize(tree):
+    """Normalise a tree in place the way `xmlsort.xsl` does; remove whitespace
+    only text, drop `xml:base` attributes and sort the other attributes by
+    name, normalising the space in their values.
+
+    >>> t = etree.fromstring('<a  z=" 1  2" b="x"> <c xml:base="f"/> t </a>').getroottree()
+    >>> normalize(t)
+    >>> etree.tostring(t)
+    b'<a b="x" z="1 2"><c/> t </a>'
+    """
+    for elem in tree.getroot().iter():
+        if elem.tail is not None and is_blank(elem.tail):
+            elem.tail = None
+        if not isinstance(elem.tag, str):
+            continue
+        if elem.text is not None and is_blank(elem.text):
+            elem.text = None
+        if not elem.attrib:
+            continue
+        attrs = []
+        for key, value in elem.attrib.items():
+            if key == XML_BASE:
+                continue
+            qname, local = _attr_name(elem, key)
+            attrs.append((qname, local, normalize_space(value)))
+        attrs.sort(key=lambda a: a[0])
+        elem.attrib.clear()
+        for qname, local, value in attrs:
+            elem.set(local, value)
+
+
+def _top_level(tree):
+    """Return all the top level nodes of a document (the root element and any
+    comments or processing instructions around it)."""
+    root = tree.getroot()
+    return list(reversed(list(root.itersiblings(preceding=True)))) + [root] + list(root.itersiblings())
+
+
+def _inside_include(elem, top):
+    """Is the element inside an include element below top?"""
+    for ancestor in elem.iterancestors():
+        if ancestor is top:
+            return False
+        if ancestor.tag == XI_INCLUDE:
+            return True
+    return False
+
+
+def _remove(elem):
+    """Remove an element, keeping the text after it."""
+    parent = elem.getparent()
+    if elem.tail:
+        prev = elem.getprevious()
+        if prev is None:
+            parent.text = (parent.text or "") + elem.tail
+        else:
+            prev.tail = (prev.tail or "") + elem.tail
+    parent.remove(elem)
+
+
+def model_key(model):
+    """Return what of a model ends up in the merged output (everything but
+    its attributes other than the name), to check duplicates against.
+
+    >>> a = etree.fromstring('<model name="m" x="1"><p/></model>')
+    >>> b = etree.fromstring('<model name="m"><p/></model>')
+    >>> model_key(a) == model_key(b)
+    True
+    >>> model_key(a) == model_key(etree.fromstring('<model name="m"><q/></model>'))
+    False
+    """
+    parts = [model.get("name", "").encode("utf-8"), (model.text or "").encode("utf-8")]
+    for child in model:
+        parts.append(etree.tostring(child, encoding="UTF-8"))
+    return b"\0".join(parts)
+
+
+def _splice(inc, nodes):
+    """Replace the include element with the nodes, which are elements,
+    comments, processing instructions or strings of text."""
+    parent = inc.getparent()
+    if parent is None:
+        raise MergeError("Can't replace the root element with an include.")
+    index = parent.index(inc)
+    prev = inc.getprevious()
+
+    def add_text(text):
+        if prev is None:
+            parent.text = (parent.text or "") + text
+        else:
+            prev.tail = (prev.tail or "") + text
+
+    for node in nodes:
+        if isinstance(node, str):
+            add_text(node)
+            continue
+        parent.insert(index, node)
+        index += 1
+        prev = node
+    if inc.tail:
+        add_text(inc.tail)
+    parent.remove(inc)
+
+
+def _without_ns_declarations(tree, elem):
+    """Return an element without any namespace declarations of its own,
+    replacing it with a new element if it has some."""
+    parent = elem.getparent()
+    inherited = parent.nsmap if parent is not None else {}
+    if elem.nsmap == inherited:
+        return elem
+    new = etree.Element(elem.tag, nsmap=inherited)
+    new.text = elem.text
+    new.tail = elem.tail
+    new.extend(elem)
+    if parent is not None:
+        parent.replace(elem, new)
+        return new
+    # Keep any comments around the root element.
+    before = list(elem.itersiblings(preceding=True))
+    after = list(elem.itersiblings())
+    tree._setroot(new)
+    for node in before:
+        new.addprevious(node)
+    for node in after:
+        new.addnext(node)
+    return new
+
+
+def dedup_models(tree):
+    """Tidy the `<models>` sections in place the way `xmlsort.xsl` does; only
+    the first `<model>` of each name in the document is kept, keeping only its
+    `name` attribute, and anything else in a `<models>` section is dropped.
+
+    >>> t = etree.fromstring('<a><models x="1"><!-- c --><model name="m" y="2"><p/></model></models>'
+    ...                      '<models><model name="m"><q/></model><model name="n"/></models></a>').getroottree()
+    >>> dedup_models(t)
+    >>> etree.tostring(t)
+    b'<a><models><model name="m"><p/></model></models><models><model name="n"/></models></a>'
+    """
+    root = tree.getroot()
+    first = {}
+    for model in root.iter("model"):
+        name = model.get("name")
+        if name is not None:
+            first.setdefault(name, model)
+
+    if root.tag == "models":
+        sections = [root] + list(root.iterdescendants("models"))
+    else:
+        sections = list(root.iterdescendants("models"))
+    for models in sections:
+        models = _without_ns_declarations(tree, models)
+        models.attrib.clear()
+        models.text = None
+        for child in list(models):
+            if child.tag != "model":
+                models.remove(child)
+                continue
+            child.tail = None
+            name = child.get("name")
+            if name is not None and first[name] is not child:
+                models.remove(child)
+                continue
+            child.attrib.clear()
+            child.set("name", name or "")
+
+
+class ModelSet:
+    """The models seen so far in a file, by name. Duplicates must be
+    identical to the first model of the same name.
+
+    >>> models = ModelSet()
+    >>> models.add(etree.fromstring('<model name="m"><p/></model>'), "a.xml")
+    True
+    >>> models.add(etree.fromstring('<model name="m"><p/></model>'), "b.xml")
+    False
+    >>> models.add(etree.fromstring('<model name="m"><q/></model>'), "c.xml")
+    Traceback (most recent call last):
+     ...
+    lib.xmlmerge.MergeError: Model m in c.xml conflicts with the one in a.xml
+    """
+
+    def __init__(self):
+        self.models = {}
+
+    def add(self, model, path):
+        """Add a model, returning False if it is a duplicate of one already
+        seen (which then shouldn't be kept)."""
+        name = model.get("name")
+        if name is None:
+            return True
+        seen = self.models.get(name)
+        if seen is None:
+            self.models[name] = [model, path, None]
+            return True
+        if seen[2] is None:
+            seen[2] = model_key(seen[0])
+        if model_key(model) != seen[2]:
+            raise MergeError("Model {} in {} conflicts with the one in {}".format(name, path, seen[1]))
+        return False
+
+
+class XmlMerger:
+    """Merges XML files, keeping the normalised tree of every file read so
+    files included many times are only processed once.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> def write(name, text):
+    ...     with open(os.path.join(d, name), "w") as f:
+    ...         _ = f.write(text)
+    >>> write("m.xml", '<models> <model name="m" x="1"/> </models>')
+    >>> write("a.xml", '<a xmlns:xi="http://www.w3.org/2001/XInclude"><models>'
+    ...                '<xi:include href="m.xml" xpointer="xpointer(models/child::node())"/>'
+    ...                '<xi:include href="m.xml" xpointer="xpointer(models/child::node())"/>'
+    ...                '</models><b  z="1" y="2"/></a>')
+    >>> merger = XmlMerger()
+    >>> print(merger.merge(os.path.join(d, "a.xml")).decode("utf-8"), end="")
+    <?xml version="1.0"?>
+    <a xmlns:xi="http://www.w3.org/2001/XInclude">
+      <models>
+        <model name="m"/>
+      </models>
+      <b y="2" z="1"/>
+    </a>
+    >>> import shutil; shutil.rmtree(d)
+    """
+
+    def __init__(self, cache_dir=None, graph=None):
+        self.trees = {}
+        self.loading = []
+        self.cache_dir = cache_dir
+        self.graph = graph if graph is not None else IncludeGraph(cache_path=None)
+        self.hashes = {}
+        self.state = {"outputs": {}, "trees": {}}
+        if cache_dir is not None:
+            self.state = self._load(os.path.join(cache_dir, "state.json"))
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {"outputs": {}, "trees": {}}
+        return data
+
+    def _cached_tree_path(self, tree_hash):
+        return os.path.join(self.cache_dir, "trees", tree_hash + ".xml")
+
+    def tree_hash(self, path, hashing=()):
+        """Return the Merkle hash of a file; a hash of its contents and the
+        hashes of the files it includes."""
+        path = os.path.abspath(path)
+        h = self.hashes.get(path)
+        if h is not None:
+            return h
+        if path in hashing:
+            raise MergeError("Include loop: {}".format(" -> ".join(hashing + (path,))))
+
+        content = self.graph.content_hash(path)
+        m = hashlib.sha256(VERSION.encode("utf-8"))
+        m.update((content or "missing").encode("utf-8"))
+        if content is not None:
+            for inc in self.graph.includes(path):
+                m.update(self.tree_hash(inc, hashing + (path,)).encode("utf-8"))
+        h = self.hashes[path] = m.hexdigest()
+        return h
+
+    def tree(self, path):
+        """Return the normalised tree of a file, with its includes resolved.
+        The tree returned is shared and must not be modified."""
+        path = os.path.abspath(path)
+        tree = self.trees.get(path)
+        if tree is not None:
+            return tree
+
+        cached = None
+        if self.cache_dir is not None:
+            tree_hash = self.tree_hash(path)
+            self.state["trees"][path] = tree_hash
+            cached = self._cached_tree_path(tree_hash)
+            if os.path.exists(cached):
+                tree = etree.parse(cached)
+                self.trees[path] = tree
+                return tree
+
+        if path in self.loading:
+            raise MergeError("Include loop: {}".format(" -> ".join(self.loading + [path])))
+        self.loading.append(path)
+        try:
+            try:
+                tree = etree.parse(path)
+            except etree.XMLSyntaxError as e:
+                raise MergeError(str(e))
+            normalize(tree)
+            self._resolve_includes(tree.getroot(), path)
+        finally:
+            self.loading.pop()
+        self.trees[path] = tree
+
+        if cached is not None:
+            write_if_changed(cached, etree.tostring(tree, encoding="UTF-8"))
+        return tree
+
+    def _included_nodes(self, inc, path, models):
+        """Return copies of the nodes an include element refers to, or None if
+        the file doesn't exist. Models already in the including file aren't
+        copied."""
+        href = inc.get("href")
+        if not href:
+            raise MergeError("{}: xi:include without a href".format(path))
+        inc_path = os.path.abspath(os.path.join(os.path.dirname(path), href))
+        if not os.path.exists(inc_path):
+            return None
+
+        if inc.get("parse", "xml") == "text":
+            with open(inc_path, "r", encoding=inc.get("encoding", "utf-8")) as f:
+                return [f.read()]
+
+        tree = self.tree(inc_path)
+        xpointer = inc.get("xpointer")
+        if xpointer is None:
+            # Like libxml2, only the root element of a whole document is
+            # included, not the comments around it.
+            nodes = [tree.getroot()]
+        else:
+            m = re.match(r"^xpointer\((.*)\)$", xpointer.strip())
+            if not m:
+                raise MergeError("{}: unsupported xpointer {!r}".format(path, xpointer))
+            # The expression is evaluated relative to the document.
+            expr = m.group(1)
+            if not expr.startswith("/"):
+                expr = "/" + expr
+            nodes = tree.xpath(expr)
+
+        copies = []
+        for node in nodes:
+            if isinstance(node, str):
+                copies.append(str(node))
+                continue
+            if node.tag == "model" and not models.add(node, inc_path):
+                continue
+            node = copy.deepcopy(node)
+            node.tail = None
+            # Models further down were already deduplicated within the
+            # included file, but may be in the including file too.
+            for model in list(node.iterdescendants("model")):
+                if not models.add(model, inc_path):
+                    _remove(model)
+            copies.append(node)
+        return copies
+
+    def _resolve_includes(self, top, path, models=None):
+        """Replace the includes below an element with what they include,
+        dropping any models already seen earlier in the file."""
+        if models is None:
+            models = ModelSet()
+        for node in list(top.iter("model", XI_INCLUDE)):
+            # Includes inside an include's fallback are only used when the
+            # fallback is (and have been replaced by then).
+            if node.getparent() is None or _inside_include(node, top):
+                continue
+            if node.tag == "model":
+                if not models.add(node, path):
+                    _remove(node)
+                continue
+            nodes = self._included_nodes(node, path, models)
+            if nodes is None:
+                fallback = node.find(XI_FALLBACK)
+                if fallback is None:
+                    raise MergeError("{}: included file {} not found".format(path, node.get("href")))
+                self._resolve_includes(fallback, path, models)
+                nodes = ([fallback.text] if fallback.text else []) + list(fallback)
+            _splice(node, nodes)
+
+    def merge(self, path):
+        """Return the merged contents of a file."""
+        tree = copy.deepcopy(self.tree(path))
+        dedup_models(tree)
+        return serialize(tree)
+
+    def update(self, path, output):
+        """Merge a file to output, unless output was already merged from the
+        same tree (needs a cache directory). The output is only rewritten if
+        it changed. Returns False if output was already up to date."""
+        output = os.path.abspath(output)
+        tree_hash = None
+        if self.cache_dir is not None:
+            tree_hash = self.tree_hash(path)
+            if self.state["outputs"].get(output) == tree_hash and os.path.exists(output):
+                return False
+        write_if_changed(output, self.merge(path))
+        if tree_hash is not None:
+            self.state["outputs"][output] = tree_hash
+        return True
+
+    def save(self):
+        """Write the hashes of the outputs and cached trees, and remove cached
+        trees which are no longer used."""
+        if self.cache_dir is None:
+            return
+        for kind in ("outputs", "trees"):
+            for path in list(self.state[kind]):
+                if not os.path.exists(path):
+                    del self.state[kind][path]
+
+        used = set(h + ".xml" for h in self.state["trees"].values())
+        trees_dir = os.path.join(self.cache_dir, "trees")
+        if os.path.isdir(trees_dir):
+            for name in os.listdir(trees_dir):
+                if name not in used:
+                    os.unlink(os.path.join(trees_dir, name))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmppath, os.path.join(self.cache_dir, "state.json"))
+
+
+def serialize(tree):
+    """Serialise a tree the way xsltproc does with `<xsl:output indent="yes">`.
+
+    >>> t = etree.fromstring('<!-- a --><b><c/></b><!-- d -->').getroottree()
+    >>> print(serialize(t).decode("utf-8"), end="")
+    <?xml version="1.0"?>
+    <!-- a -->
+    <b>
+      <c/>
+    </b><!-- d -->
+    """
+    parts = [HEADER]
+    nodes = _top_level(tree)
+    for i, node in enumerate(nodes):
+        text = etree.tostring(node, encoding="UTF-8", pretty_print=True, with_tail=False)
+        parts.append(text.rstrip(b"\n"))
+        # Only comments followed by another node get a new line of their own.
+        if isinstance(node, etree._Comment) and i + 1 < len(nodes):
+            parts.append(b"\n")
+    parts.append(b"\n")
+    return b"".join(parts)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
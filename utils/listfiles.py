@@ -4,16 +4,23 @@
 Find all source files in the repo.
 
 Excludes the files in the top level .excludes file.
+
+In a git checkout the git index is used to list the files, otherwise the
+directories scanned are remembered in a manifest, so later runs only re-read
+the directories which changed. Many glob queries can be answered in one run,
+and the results (and the directories) can be written as a makefile fragment.
 """
 
 import argparse
-import fnmatch
 import os.path
-import re
-import subprocess
 import sys
 
 from lib.argparse_extra import ActionStoreBool
+from lib.files import DEFAULT_MANIFEST
+from lib.files import FileIndex
+from lib.files import make_fragment
+from lib.files import read_excludes
+from lib.outputs import write_if_changed
 
 MYFILE = os.path.abspath(__file__)
 MYDIR = os.path.dirname(MYFILE)
@@ -36,6 +43,35 @@ parser.add_argument(
     nargs="*", default=[],
     help="Extra exclude patterns to add.")
 
+parser.add_argument(
+    '--git', '--no-git',
+    action=ActionStoreBool, default=True,
+    help="Use the git index to list the files when in a git checkout.")
+
+parser.add_argument(
+    '--dirs', '--no-dirs',
+    action=ActionStoreBool, default=False,
+    help="List the directories rather than the files.")
+
+parser.add_argument(
+    '--manifest',
+    default=DEFAULT_MANIFEST,
+    help="Manifest to store the index in, 'none' to always scan everything.")
+
+parser.add_argument(
+    '--query',
+    action='append', default=[],
+    help="""\
+Only list files matching this glob (see glob2regex in make/inc/files.mk). Can
+be given many times. With --makefile, use VAR=GLOB to set VAR to the matches.""")
+
+parser.add_argument(
+    '--makefile',
+    help="""\
+Write a makefile fragment setting FILES_EXISTING, DIRS_EXISTING (and the
+variables of any queries) rather than printing the files. Only written if it
+changed.""")
+
 parser.add_argument(
     'directory',
     nargs="*", default=[TOPDIR],
@@ -46,8 +82,18 @@ def stderr(*args, **kw):
     print(*args, **kw, file=sys.stderr, flush=True)
 
 
-def normpath(r, f):
-    return os.path.normpath(os.path.join(r, f))
+def parse_query(query):
+    """Split a query into its variable name (or None) and glob.
+
+    >>> parse_query("XML=*.xml")
+    ('XML', '*.xml')
+    >>> parse_query("*.v")
+    (None, '*.v')
+    """
+    name, sep, pattern = query.partition("=")
+    if sep and "/" not in name and "*" not in name:
+        return name, pattern
+    return None, query
 
 
 def main(argv):
@@ -60,40 +106,41 @@ def main(argv):
 
     stderr("Top level directory:", TOPDIR)
 
-    exclude_patterns = args.exclude
-    with open(os.path.join(TOPDIR, ".excludes"), "r") as exclude_file:
-        for line in exclude_file:
-            # Strip comments
-            if '#' in line:
-                line = line[:line.find('#')]
-
-            # Strip whitespace
-            line = line.strip()
-
-            # Skip empty lines
-            if not line:
-                continue
-
-            exclude_patterns.append(line)
+    exclude_patterns = args.exclude + read_excludes()
 
     stderr("Exclude patterns:", exclude_patterns)
     stderr("Will search:", args.directory)
-    for path in args.directory:
-        stderr("Looking in:", path)
-        for root, dirs, files in os.walk(path, topdown=True):
-            for pattern in exclude_patterns:
-                # Filter out the directories we want to ignore
-                for d in fnmatch.filter(dirs, pattern):
-                    stderr(" -dir", normpath(root, d))
-                    dirs.remove(d)
-
-                # Filter out the files
-                for f in fnmatch.filter(files, pattern):
-                    stderr("-file", normpath(root, f))
-                    files.remove(f)
-
-            for f in files:
-                print(os.path.normpath(os.path.join(root, f)))
+
+    manifest = args.manifest
+    if manifest == 'none':
+        manifest = None
+    index = FileIndex(args.directory, exclude_patterns, manifest_path=manifest, log=stderr, use_git=args.git)
+    index.update()
+    index.save()
+
+    queries = [parse_query(q) for q in args.query]
+
+    if args.makefile:
+        variables = [("FILES_EXISTING", index.files()), ("DIRS_EXISTING", index.dirs())]
+        for name, pattern in queries:
+            if name is not None:
+                variables.append((name, index.query(pattern)))
+        if write_if_changed(args.makefile, make_fragment(variables)):
+            stderr("Generated", args.makefile)
+        return 0
+
+    if args.dirs:
+        files = index.dirs()
+    elif queries:
+        files = set()
+        for name, pattern in queries:
+            files.update(index.query(pattern))
+        files = sorted(files)
+    else:
+        files = index.files()
+
+    for f in files:
+        print(f)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Merge XML files, resolving their `xi:include`s, sorting their attributes and
+removing duplicate models (see `lib/xmlmerge.py`).
+
+Many files can be merged in one run, sharing the work of reading the files
+they have in common. The output of `X.xml` is written to `X.merged.xml`, and
+only if it changed. Normalised trees and the hashes of the outputs are kept in
+a cache directory, so outputs are only merged again when something they
+include changed.
+"""
+
+import argparse
+import os
+import sys
+
+from lib.deps import read_inputs
+from lib.includes import default_graph
+from lib.xmlmerge import MergeError
+from lib.xmlmerge import XmlMerger
+
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.abspath(os.path.join(MYDIR, ".."))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "inputfiles",
+    nargs="*",
+    help="Input XML files")
+parser.add_argument(
+    "--files-from",
+    help="File containing a list of input files, '-' for stdin")
+parser.add_argument(
+    "--output", "-o",
+    help="Output file, when merging a single input file")
+parser.add_argument(
+    "--cache-dir",
+    default=os.path.join(TOPDIR, ".deps", "xmlmerge"),
+    help="Directory to keep normalised trees and output hashes in, 'none' to always merge everything")
+parser.add_argument(
+    "--verbose", "-v",
+    action="store_true",
+    help="Print each file generated")
+
+
+def merged_name(filepath):
+    """Get the name of the merged output of a file.
+
+    Python version of `$(call merged_xml_name,{})` in make/xml.mk
+
+    >>> merged_name("/a/b/arch.xml")
+    '/a/b/arch.merged.xml'
+    """
+    return os.path.splitext(filepath)[0] + ".merged.xml"
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    inputs = read_inputs(args.inputfiles, args.files_from)
+    if args.output is not None and len(inputs) != 1:
+        parser.error("--output can only be used with a single input file")
+
+    cache_dir = args.cache_dir
+    if cache_dir == 'none':
+        cache_dir = None
+    merger = XmlMerger(cache_dir=cache_dir, graph=default_graph())
+
+    merged = 0
+    for inputfile in inputs:
+        outputfile = args.output or merged_name(inputfile)
+        try:
+            if not merger.update(inputfile, outputfile):
+                continue
+        except (MergeError, OSError) as e:
+            print("Failed to merge {}: {}".format(inputfile, e), file=sys.stderr)
+            merger.save()
+            return 1
+        merged += 1
+        if args.verbose:
+            print("Merged", outputfile)
+    merger.save()
+
+    if args.verbose:
+        print("Merged {} of {} files".format(merged, len(inputs)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
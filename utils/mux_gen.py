@@ -5,19 +5,26 @@ Generate MUX.
 MUXes come in two types,
  1) Configurable via logic signals,
  2) Statically configured by PnR (called "routing") muxes.
+
+Many muxes can be generated in one run from a manifest, which has the
+arguments for one mux on each line.
 """
 
 import argparse
+import concurrent.futures
 import io
 import itertools
 import lxml.etree as ET
 import math
 import os
+import shlex
 import sys
 
 from lib import mux as mux_lib
 from lib.argparse_extra import ActionStoreBool
 from lib.asserts import assert_eq
+from lib.outputs import open_output
+from lib.outputs import write_if_changed
 
 parser = argparse.ArgumentParser(
     description='Generate a MUX wrapper.',
@@ -57,7 +64,7 @@ parser.add_argument(
     '--name-input', type=str, default='I',
     help="Name of the input values for the mux.")
 
-parser.name_inputs = parser.add_argument(
+parser.add_argument(
     '--name-inputs', type=str, default=None,
     help="Comma deliminator list for the name of each input to the mux (implies --split-inputs).")
 
@@ -69,7 +76,7 @@ parser.add_argument(
     '--name-select', type=str, default='S',
     help="Name of the select parameter for the mux.")
 
-parser.name_selects = parser.add_argument(
+parser.add_argument(
     '--name-selects', type=str, default=None,
     help="Comma deliminator list for the name of each select to the mux (implies --split-selects).")
 
@@ -98,12 +105,42 @@ parser.add_argument(
     '--subckt', default=None,
     help="""Override the subcircuit name.""")
 
+parser.add_argument(
+    '--tree', '--no-tree',
+    action=ActionStoreBool, default=False,
+    help="""Simulate the mux as a balanced tree of MUX4s and MUX2s (rather than one flat MUX), with matching delays.""")
 
-def main(argv):
-    call_args = list(argv)
-
-    args = parser.parse_args()
+parser.add_argument(
+    '--manifest', default=None,
+    help="""Generate every mux in this file, which has the arguments for one mux on each line.""")
 
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1,
+    help="""Number of muxes from the manifest to generate in parallel.""")
+
+
+def read_manifest(lines):
+    """Parse the arguments for each mux in a manifest, skipping empty lines
+    and comments.
+
+    >>> configs = read_manifest(['# c', '', '--width 2 --name-mux A', '--name-mux B --comment "x y"'])
+    >>> [(c.name_mux, c.width, c.comment) for c in configs]
+    [('A', 2, None), ('B', 8, 'x y')]
+    """
+    configs = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        args = parser.parse_args(shlex.split(line))
+        if args.manifest:
+            parser.error("A manifest can't include another manifest: {}".format(line))
+        configs.append(args)
+    return configs
+
+
+def generate(args):
+    """Generate the files for one mux."""
     def output_block(name, s):
         if args.verbose:
             print()
@@ -130,12 +167,17 @@ def main(argv):
 
     outdir = normpath(outdir)
 
-    mydir = normpath(os.path.dirname(mypath), to=outdir)
+    # Paths are relative to the output directory, not the current one, as
+    # many muxes can be generated in one run.
+    mydir = os.path.dirname(mypath)
     mypath = normpath(mypath, to=outdir)
     mux_dir = normpath(os.path.join(mydir, '..', 'vpr', 'muxes'), to=outdir)
     buf_dir = normpath(os.path.join(mydir, '..', 'vpr', 'buf'), to=outdir)
     mux_mk = normpath(os.path.join(mydir, '..', 'common', 'make', 'mux.mk'), to=outdir)
 
+    # Names given explicitly are written to the Makefile.mux, the generated
+    # ones aren't.
+    explicit_inputs = bool(args.name_inputs)
     if args.name_inputs:
         assert_eq(args.name_input, parser.get_default("name_input"))
         args.name_input = None
@@ -146,9 +188,8 @@ def main(argv):
         args.name_inputs = names
     elif args.split_inputs:
         args.name_inputs = [args.name_input+str(i) for i in range(args.width)]
-        parser.name_inputs.default = args.name_inputs
-        assert_eq(parser.get_default("name_inputs"), args.name_inputs)
 
+    explicit_selects = bool(args.name_selects)
     if args.name_selects:
         assert_eq(args.name_select, parser.get_default("name_select"))
         args.name_select = None
@@ -159,8 +200,6 @@ def main(argv):
         args.name_selects = names
     elif args.split_selects:
         args.name_selects = [args.name_select+str(i) for i in range(args.width_bits)]
-        parser.name_selects.default = args.name_selects
-        assert_eq(parser.get_default("name_selects"), args.name_selects)
 
     os.makedirs(outdir, exist_ok=True)
 
@@ -206,7 +245,7 @@ Generated with %s
         # Optional values
         if args.split_inputs:
             print("MUX_SPLIT_INPUTS = 1", file=f)
-            if args.name_inputs != parser.get_default('name_inputs'):
+            if explicit_inputs:
                 print("MUX_INPUTS = {}".format(",".join(args.name_inputs)), file=f)
         else:
             if args.name_input != parser.get_default('name_input'):
@@ -214,7 +253,7 @@ Generated with %s
 
         if args.split_selects:
             print("MUX_SPLIT_SELECTS = 1", file=f)
-            if args.name_selects != parser.get_default('name_selects'):
+            if explicit_selects:
                 print("MUX_SELECTS = {}".format(",".join(args.name_selects)), file=f)
         else:
             if args.name_select != parser.get_default('name_select'):
@@ -229,16 +268,12 @@ Generated with %s
         if args.subckt != parser.get_default('subckt'):
             print("MUX_SUBCKT = {}".format(args.subckt), file=f)
 
-    new_makefile_contents = new_makefile_contents.getvalue()
-    if not os.path.exists(makefile_file):
-        current_makefile_contents = ""
-    else:
-        current_makefile_contents = open(makefile_file, "r").read()
-
-    if current_makefile_contents != new_makefile_contents:
-        open(makefile_file, "w").write(new_makefile_contents)
+        if args.tree:
+            print("MUX_TREE = 1", file=f)
 
-    output_block("Makefile.mux", open(makefile_file).read())
+    new_makefile_contents = new_makefile_contents.getvalue()
+    write_if_changed(makefile_file, new_makefile_contents)
+    output_block("Makefile.mux", new_makefile_contents)
 
     # ------------------------------------------------------------------------
     # Work out the port and their names
@@ -269,7 +304,7 @@ Generated with %s
     defs = {'i': 'input wire', 's': 'input wire', 'o': 'output wire'}
 
     sim_pathname = os.path.join(outdir, sim_filename)
-    with open(sim_pathname, "w") as f:
+    with open_output(sim_pathname) as f:
         module_args = []
         for type, name, _, _ in port_names:
             if args.type == 'routing' and type == mux_lib.MuxPinType.SELECT:
@@ -282,11 +317,17 @@ Generated with %s
         f.write("/* ")
         f.write("\n * ".join(generated_with.splitlines()))
         f.write("\n */\n\n")
-        f.write('`include "%s/%s/%smux%i/%smux%i.sim.v"\n' % (
-            mux_dir, 'logic',
-            '', args.width,
-            '', args.width,
-        ))
+        if args.tree:
+            levels = mux_lib.mux_tree(args.width)
+            level_widths = sorted(set(w for w, _ in levels))
+        else:
+            level_widths = [args.width]
+        for width in level_widths:
+            f.write('`include "%s/%s/%smux%i/%smux%i.sim.v"\n' % (
+                mux_dir, 'logic',
+                '', width,
+                '', width,
+            ))
         f.write("\n")
         f.write('(* blackbox *) (* CLASS="%s" *)\n' % mux_class)
         f.write("module %s(%s);\n" % (args.name_mux, ", ".join(module_args)))
@@ -307,8 +348,7 @@ Generated with %s
             else:
                 f.write('\t%s %s %s;\n' % (type.verilog(), index, name))
 
-        f.write("\n")
-        f.write('\tMUX%s mux (\n' % args.width)
+        inputs = []
         for i in range(0, args.width):
             j = 0
             for type, name, width, index in port_names:
@@ -320,35 +360,75 @@ Generated with %s
                 break
 
             if width == 1:
-                f.write('\t\t.I%i(%s),\n' % (i, name))
+                inputs.append(name)
             else:
-                f.write('\t\t.I%i(%s[%i]),\n' % (i, name, i-j))
+                inputs.append('%s[%i]' % (name, i-j))
 
+        selects = []
         for i in range(0, args.width_bits):
             j = 0
             for type, name, width, index in port_names:
                 if type != mux_lib.MuxPinType.SELECT:
                     continue
-                if j+width < i:
+                if j+width <= i:
                     j += width
                     continue
                 break
 
             if width == 1:
-                f.write('\t\t.S%i(%s),\n' % (i, name))
+                selects.append(name)
             else:
-                f.write('\t\t.S%i(%s[%i]),\n' % (i, name, i-j))
+                selects.append('%s[%i]' % (name, i-j))
 
         for type, name, width, index in port_names:
             if type != mux_lib.MuxPinType.OUTPUT:
                 continue
             break
         assert_eq(width ,  1)
-        f.write('\t\t.O(%s)\n\t);\n' % name)
+        output = name
+
+        f.write("\n")
+        if not args.tree:
+            f.write('\tMUX%s mux (\n' % args.width)
+            for i, name in enumerate(inputs):
+                f.write('\t\t.I%i(%s),\n' % (i, name))
+            for i, name in enumerate(selects):
+                f.write('\t\t.S%i(%s),\n' % (i, name))
+            f.write('\t\t.O(%s)\n\t);\n' % output)
+        else:
+            # Each level muxes groups of the signals from the level before,
+            # the inputs past the end are tied off.
+            wires = []
+            instances = []
+            signals = inputs
+            for level, (width, first_bit) in enumerate(levels):
+                outputs = []
+                for g in range(0, len(signals), width):
+                    group = signals[g:g+width]
+                    group += ["1'b0"] * (width - len(group))
+                    if level == len(levels) - 1:
+                        o = output
+                    else:
+                        o = 'tree%i_%i' % (level, g // width)
+                        wires.append(o)
+                    outputs.append(o)
+                    ports = ['.I%i(%s)' % (i, n) for i, n in enumerate(group)]
+                    ports += ['.S%i(%s)' % (i, selects[first_bit+i]) for i in range(mux_lib.clog2(width))]
+                    ports.append('.O(%s)' % o)
+                    instances.append('\tMUX%i mux%i_%i (%s);\n' % (width, level, g // width, ", ".join(ports)))
+                signals = outputs
+            assert_eq(signals, [output])
+
+            for wire in wires:
+                f.write('\twire %s;\n' % wire)
+            if wires:
+                f.write("\n")
+            for instance in instances:
+                f.write(instance)
 
         f.write('endmodule\n')
 
-    output_block(sim_filename, open(sim_pathname).read())
+    output_block(sim_filename, f.getvalue())
 
     if args.type == 'logic':
         subckt = args.subckt or args.name_mux
@@ -387,8 +467,7 @@ Generated with %s
         models_str = "<models><!-- No models for routing elements.--></models>"
 
     output_block(model_xml_filename, models_str)
-    with open(os.path.join(outdir, model_xml_filename), "w") as f:
-        f.write(models_str)
+    write_if_changed(os.path.join(outdir, model_xml_filename), models_str)
 
     # ------------------------------------------------------------------------
     # Generate the pb_type XML form.
@@ -401,15 +480,36 @@ Generated with %s
         subckt=subckt,
         num_pb=args.num_pb,
         comment=xml_comment_indent(4, xml_comment),
+        tree=args.tree,
     )
 
     pb_type_str = ET.tostring(pb_type_xml, pretty_print=True).decode('utf-8')
     output_block(pbtype_xml_filename, pb_type_str)
-    with open(os.path.join(outdir, pbtype_xml_filename), "w") as f:
-        f.write(pb_type_str)
+    write_if_changed(os.path.join(outdir, pbtype_xml_filename), pb_type_str)
 
     print("Generated mux {} in {}".format(args.name_mux, outdir))
 
 
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    if not args.manifest:
+        generate(args)
+        return 0
+
+    with open(args.manifest, "r") as f:
+        configs = read_manifest(f)
+
+    if args.jobs <= 1:
+        for config in configs:
+            generate(config)
+        return 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for _ in executor.map(generate, configs):
+            pass
+    return 0
+
+
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
@@ -1,29 +1,59 @@
 #! /usr/bin/env python3
+"""
+Create files from templates by replacing N with other values.
 
+A template called `ntemplate.<name>` generates a file for each value, named
+`<name>` with every N replaced by the value, and with `{N}` in its contents
+replaced by the value in upper case.
+
+Either one template is expanded to one output (`n.py TEMPLATE OUTPUT`), or
+a list of templates are each expanded for every value in one run
+(`n.py TEMPLATE... --values a b c`), the outputs going next to their
+templates. Each template is read once, and outputs are only written when
+their contents change.
+"""
+
+import argparse
 import os
-import pprint
-import re
 import sys
 
 from lib.asserts import assert_eq
+from lib.outputs import write_if_changed
 
 TEMPLATE_PREFIX = "ntemplate."
 
-def mreplace(s, replacements):
-    # use these three lines to do the replacement
-    rep = dict((re.escape(k), v) for k, v in replacements.items())
-    pattern = re.compile("|".join(rep.keys()))
-    return pattern.sub(lambda m: rep[re.escape(m.group(0))], s)
+parser = argparse.ArgumentParser(description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument(
+    '--values', nargs='+', default=None,
+    help="Expand every template for each of these values.")
+parser.add_argument(
+    'paths', nargs='+',
+    help="TEMPLATE OUTPUT, or with --values, the templates to expand.")
+
+
+def output_name(template_name, value):
+    """The name of the file generated from a template for a value.
 
+    >>> output_name("ntemplate.Nlut.pb_type.xml", "a")
+    'alut.pb_type.xml'
+    >>> output_name("ntemplate.carry4_Nmux.sim.v", "b")
+    'carry4_bmux.sim.v'
+    """
+    assert template_name.startswith(TEMPLATE_PREFIX), template_name
+    return template_name[len(TEMPLATE_PREFIX):].replace("N", value)
 
-def main(args):
-    inpath = args[0]
+
+def template_value(inpath, outpath):
+    """Work out the value a template was expanded with from the output name.
+
+    >>> template_value("d/ntemplate.Nlut.sim.v", "d/clut.sim.v")
+    'c'
+    """
     infile = os.path.basename(inpath)
     indir = os.path.dirname(inpath)
     assert infile.startswith(TEMPLATE_PREFIX), infile
     infile_bit = infile[len(TEMPLATE_PREFIX):]
 
-    outpath = args[1]
     outfile = os.path.basename(outpath)
     outdir = os.path.dirname(outpath)
     assert len(infile_bit) == len(outfile)
@@ -31,7 +61,6 @@ def main(args):
     assert_eq(indir, outdir)
 
     replacement = None
-    current_from, current_to = "", ""
     for i, o in zip(infile_bit, outfile):
         if i != 'N':
             assert_eq(i, o)
@@ -41,12 +70,50 @@ def main(args):
             replacement = o
 
         assert_eq(replacement, o)
+    return replacement
+
+
+def expand(template, value):
+    """Expand the contents of a template for a value.
+
+    >>> expand("module {N}LUT;", "a")
+    'module ALUT;'
+    """
+    return template.format(N=value.upper())
+
+
+def expand_templates(inpaths, values):
+    """Expand every template for every value. Returns the number of outputs
+    which changed."""
+    changed = 0
+    for inpath in inpaths:
+        infile = os.path.basename(inpath)
+        with open(inpath, "r") as f:
+            template = f.read()
+        for value in values:
+            outpath = os.path.join(os.path.dirname(inpath), output_name(infile, value))
+            if write_if_changed(outpath, expand(template, value)):
+                print("Generated {} from {}".format(os.path.relpath(outpath), infile))
+                changed += 1
+    return changed
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    if args.values is not None:
+        expand_templates(args.paths, args.values)
+        return 0
+
+    if len(args.paths) != 2:
+        parser.error("Expected TEMPLATE OUTPUT, or --values with templates.")
+    inpath, outpath = args.paths
 
-    template = open(inpath, "r").read()
-    open(outpath, "w").write(template.format(N=replacement.upper()))
-    print("Generated {} from {}".format(os.path.relpath(outpath), infile))
+    with open(inpath, "r") as f:
+        template = f.read()
+    if write_if_changed(outpath, expand(template, template_value(inpath, outpath))):
+        print("Generated {} from {}".format(os.path.relpath(outpath), os.path.basename(inpath)))
 
 
 if __name__ == "__main__":
-    import sys
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv))
@@ -1,78 +1,106 @@
 #!/usr/bin/env python3
 """
-Set a file to the newest modified time of the other files.
+Update a stamp file when the contents of the other files change.
+
+The stamp contains a hash of the contents of the files, and is only rewritten
+(so its modification time only advances) when that hash changes. Files which
+are touched but not changed don't cause anything depending on the stamp to be
+rebuilt. See `lib/stamps.py`.
+
+With --deps-from, the `.d` stamps of many files are updated in one run
+instead, see `lib.deps.update_deps_stamps`. Only the stamps of the files
+which changed (given with --changed-from), or which include a file which
+changed, are checked.
 """
 
 import argparse
 import os
 import sys
-import time
 
 from lib import argparse_extra
-from lib.asserts import assert_eq
+from lib.deps import DependencyGraph
+from lib.deps import read_inputs
+from lib.deps import update_deps_stamps
+from lib.stamps import StampDB
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--outfile", "--output", "-o",
-    type=str,
+    type=str, default=None,
+    help="""\
+The stamp file to update.
+""")
+parser.add_argument(
+    "--deps-from",
+    type=str, default=None,
+    help="""\
+File containing a list of files to update the .d stamps of, instead of
+updating one stamp.
+""")
+parser.add_argument(
+    "--graph-from",
+    type=str, default=None,
     help="""\
-The file to set the modtime on.
+File containing a list of the Verilog and XML files whose includes are
+followed for --deps-from.
+""")
+parser.add_argument(
+    "--changed-from",
+    type=str, default=None,
+    help="""\
+File containing a list of the files which changed, for --deps-from.
 """)
 parser.add_argument(
     "--verbose",
-    action=argparse_extra.ActionStoreBool, default=os.environ.get('V', '')==1,
+    action=argparse_extra.ActionStoreBool, default=os.environ.get('V', '')=='1',
     help="""\
-Files to get the input time from.
+Print whether the stamp was updated.
 """)
 parser.add_argument(
     "files",
-    type=str, nargs="+",
+    type=str, nargs="*",
     help="""\
-Files to get the input time from.
+Files to hash the contents of.
 """)
 
 
-my_path = os.path.abspath(__file__)
-my_dir = os.path.dirname(my_path)
-topdir = os.path.abspath(os.path.join(my_dir, ".."))
+def update_deps(args):
+    graph = DependencyGraph(read_inputs([], args.graph_from))
+    db = StampDB()
+    written = update_deps_stamps(
+        read_inputs([], args.deps_from), graph, read_inputs(args.files, args.changed_from), db)
+    db.save()
+
+    if args.verbose:
+        for stamp in written:
+            print("Contents changed, updated {}".format(stamp))
 
 
 def main(argv):
     args = parser.parse_args(argv[1:])
 
-    t = 0
-    newest = None
+    if args.deps_from is not None:
+        return update_deps(args)
+
+    if args.outfile is None or not args.files:
+        parser.error("Expected --output and files, or --deps-from.")
+
     for filepath in args.files:
         if not os.path.exists(filepath):
             print("Did not find {}, skipping!".format(filepath), file=sys.stderr)
             continue
         assert os.path.isfile(filepath), filepath
 
-        mtime = os.path.getmtime(filepath)
-        if args.verbose:
-            print("{} has modtime of {}".format(filepath, mtime))
-        if mtime > t:
-            newest = filepath
-            t = mtime
-
-    if not newest:
-        print("Did not find any files, using current time!", file=sys.stderr)
-        t = time.time()
-
-    if not os.path.exists(args.outfile):
-        f = open(args.outfile, "w")
-        f.close()
-
-    assert os.path.exists(args.outfile), args.outfile
-    assert os.path.isfile(args.outfile), args.outfile
-    if os.path.getmtime(args.outfile) == t:
-        if args.verbose:
-            print("modtime of {} already {} (from {})".format(args.outfile, t, newest))
-            t += 1
+    db = StampDB()
+    updated = db.update(args.outfile, args.files)
+    db.save()
+
     if args.verbose:
-        print("Setting modtime of {} to {} (from {})".format(args.outfile, t, newest))
-    os.utime(args.outfile, times=(time.time(), t))
+        if updated:
+            print("Contents changed, updated {}".format(args.outfile))
+        else:
+            print("Contents unchanged, left {} alone".format(args.outfile))
 
 
 if __name__ == "__main__":
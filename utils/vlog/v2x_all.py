@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Convert every Verilog simulation model under a directory to VPR XML.
+
+Finds each directory containing a `Makefile.v2x` and generates both the
+`xxx.model.xml` and the `xxx.pb_type.xml` for every (non-template) `xxx.sim.v`
+file in it, in the same way as `make/types/v2x.mk` does.
+
+Files are converted in `include order, leaf models first, with files which
+don't depend on each other converted in parallel. Each worker process keeps a
+persistent Yosys running (see `yosys.run.use_worker_pool`) and shares the Yosys
+JSON cache, so the model and pb_type of a file don't pay for starting Yosys
+twice.
+
+With `--changed-only`, only files whose contents (or the contents of anything
+they `include) changed since the last run are converted.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import yosys.cache
+import yosys.run
+from lib.includes import default_graph
+from vlog_to_model import vlog_to_model
+from vlog_to_pbtype import vlog_to_pbtype
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
+
+STATE_FILE = os.path.join(TOP_DIR, ".deps", "v2x-hashes.json")
+
+# Changing any of these changes the output
+GEN_SCRIPTS = [
+    os.path.join(MY_DIR, "vlog_to_model.py"),
+    os.path.join(MY_DIR, "vlog_to_pbtype.py"),
+    os.path.join(MY_DIR, "xmlinc.py"),
+]
+
+top_re = re.compile(r'^\s*TOP_MODULE\s*:?=\s*(\S+)\s*$')
+
+parser = argparse.ArgumentParser(description=__doc__.strip())
+parser.add_argument(
+    'dirs',
+    metavar='dir', type=str, nargs='*', default=[TOP_DIR],
+    help="""\
+Directories to search for Makefile.v2x files, default is the whole repository.
+""")
+parser.add_argument(
+    '-j', '--jobs',
+    type=int, default=os.cpu_count(),
+    help="""\
+Number of files to convert in parallel, default is the number of CPUs.
+""")
+parser.add_argument(
+    '--changed-only',
+    action='store_true',
+    help="""\
+Only convert files whose contents, or included files, changed since the last
+run.
+""")
+parser.add_argument(
+    '--no-worker',
+    action='store_true',
+    help="""\
+Start a new Yosys for each run rather than keeping one running per job.
+""")
+
+
+def v2x_top(makefile):
+    """Return the TOP_MODULE set in a Makefile.v2x, or None."""
+    with open(makefile, 'r') as f:
+        for line in f:
+            m = top_re.match(line)
+            if m:
+                return m.group(1)
+    return None
+
+
+def find_inputs(dirs):
+    """Find all the inputs to convert under the given directories.
+
+    Returns a dictionary mapping absolute .sim.v path to the top level module
+    (or None to use the default).
+    """
+    inputs = {}
+    for d in dirs:
+        for root, subdirs, files in os.walk(os.path.abspath(d)):
+            subdirs[:] = sorted(s for s in subdirs if not s.startswith("."))
+            if "Makefile.v2x" not in files:
+                continue
+            top = v2x_top(os.path.join(root, "Makefile.v2x"))
+            for name in sorted(files):
+                if not name.endswith(".sim.v") or name.startswith("ntemplate."):
+                    continue
+                inputs[os.path.join(root, name)] = top
+    return inputs
+
+
+def include_levels(infiles, graph = None):
+    """Group files into levels, where files only `include files from earlier
+    levels. Files in the same level can be converted in parallel.
+
+    >>> import shutil, tempfile
+    >>> from lib.includes import IncludeGraph
+    >>> d = tempfile.mkdtemp()
+    >>> for name, text in [("a.sim.v", '`include "b.sim.v"'), ("b.sim.v", ""), ("c.sim.v", "")]:
+    ...     with open(os.path.join(d, name), "w") as f:
+    ...         _ = f.write(text)
+    >>> levels = include_levels([os.path.join(d, n) for n in ("a.sim.v", "b.sim.v", "c.sim.v")],
+    ...                         IncludeGraph(cache_path=None))
+    >>> [[os.path.basename(p) for p in level] for level in levels]
+    [['b.sim.v', 'c.sim.v'], ['a.sim.v']]
+    >>> shutil.rmtree(d)
+    """
+    if graph is None:
+        graph = default_graph()
+    closures = {f: set(graph.closure([f])) for f in infiles}
+    levels = []
+    done = set()
+    todo = sorted(infiles)
+    while todo:
+        level = [f for f in todo if not (closures[f] & set(todo)) - {f}]
+        assert level, "circular `include between {}".format(todo)
+        levels.append(level)
+        done.update(level)
+        todo = [f for f in todo if f not in done]
+    return levels
+
+
+def input_hash(infile, top):
+    """Hash of everything which changes the outputs generated from infile."""
+    h = hashlib.sha256()
+    for f in GEN_SCRIPTS + [infile] + yosys.cache.include_closure([infile]):
+        h.update("{}\0{}\0".format(f, yosys.cache.file_hash(f)).encode("utf-8"))
+    h.update(str(top).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmpfile = STATE_FILE + ".tmp"
+    with open(tmpfile, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmpfile, STATE_FILE)
+
+
+# Whether this process has been set up by convert() yet.
+_initialised = False
+
+
+def convert(infile, top, use_worker):
+    """Generate the model.xml and pb_type.xml for a .sim.v file.
+
+    The first call in each process sets it up, as ProcessPoolExecutor only
+    takes an initializer from Python 3.7.
+    """
+    global _initialised
+    if not _initialised:
+        if use_worker:
+            yosys.run.use_worker_pool(1)
+        _initialised = True
+
+    base = infile[:-len(".sim.v")]
+    vlog_to_model([infile], top, base + ".model.xml")
+    vlog_to_pbtype([infile], top, base + ".pb_type.xml")
+    return infile
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    inputs = find_inputs(args.dirs)
+
+    state = load_state()
+    hashes = {f: input_hash(f, top) for f, top in inputs.items()}
+    if args.changed_only:
+        todo = [f for f in inputs if state.get(f) != hashes[f]]
+    else:
+        todo = list(inputs)
+    if not todo:
+        print("Nothing to do, {} files up to date".format(len(inputs)))
+        return 0
+
+    jobs = max(1, args.jobs or 1)
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for level in include_levels(todo):
+            futures = {executor.submit(convert, f, inputs[f], not args.no_worker): f for f in level}
+            for future in concurrent.futures.as_completed(futures):
+                f = futures[future]
+                try:
+                    future.result()
+                except (Exception, SystemExit) as e:
+                    print("ERROR converting {}: {}".format(f, e), file=sys.stderr)
+                    failed.append(f)
+                    continue
+                state[f] = hashes[f]
+
+    save_state(state)
+
+    if failed:
+        print("Failed to convert {} of {} files".format(len(failed), len(todo)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
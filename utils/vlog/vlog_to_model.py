@@ -21,9 +21,13 @@ import os, tempfile, sys
 
 import lxml.etree as ET
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 import yosys.run
 from yosys.json import YosysJSON
 import xmlinc
+from lib.includes import default_graph
+from lib.outputs import write_if_changed
 
 parser = argparse.ArgumentParser(description=__doc__.strip())
 parser.add_argument(
@@ -46,97 +50,108 @@ parser.add_argument(
 Output filename, default 'model.xml'
 """)
 
-args = parser.parse_args()
-iname = os.path.basename(args.infiles[0])
+def vlog_to_model(infiles, top, outfile):
+    """Generate a VPR `model.xml` file from the given Verilog files.
 
-outfile = "model.xml"
-if "o" in args and args.o is not None:
-    outfile = args.o
+    Inputs
+    -------
+    infiles : list of input files, the first is the model to generate
+    top : top level module, or None to determine it from the file name
+    outfile : path to write the model.xml to
+    """
+    iname = os.path.basename(infiles[0])
 
-aig_json = yosys.run.vlog_to_json(args.infiles, flatten=True, aig=True)
+    aig_json = yosys.run.vlog_to_json(infiles, flatten=True, aig=True)
 
-if args.top is not None:
-    yj = YosysJSON(aig_json, args.top)
-    top = yj.top
-else:
-    wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", iname)
-    if wm:
-        top = wm.group(1).upper()
+    if top is not None:
+        yj = YosysJSON(aig_json, top)
+        top = yj.top
     else:
-        print("ERROR file name not of format %.sim.v ({}), cannot detect top level. Manually specify the top level module using --top").format(iname)
-        sys.exit(1)
-    yj = YosysJSON(aig_json, top)
-
-if top is None:
-    print("ERROR: more than one module in design, cannot detect top level. Manually specify the top level module using --top")
-    sys.exit(1)
-
-tmod = yj.top_module
-models_xml = ET.Element("models", nsmap = {'xi': xmlinc.xi_url})
-
-inc_re = re.compile(r'^\s*`include\s+"([^"]+)"')
-
-deps_files = set()
-# XML dependencies need to correspond 1:1 with Verilog includes, so we have
-# to do this manually rather than using Yosys
-with open(args.infiles[0], 'r') as f:
-    for line in f:
-        im = inc_re.match(line)
-        if not im:
-            continue
-        deps_files.add(im.group(1))
-
-if len(deps_files) > 0:
-    # Has dependencies, not a leaf model
-    for df in sorted(deps_files):
-        abs_base = os.path.dirname(os.path.abspath(args.infiles[0]))
-        abs_dep = os.path.normpath(os.path.join(abs_base, df))
-        module_path = os.path.dirname(abs_dep)
-        module_basename = os.path.basename(abs_dep)
-        wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", module_basename)
+        wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", iname)
         if wm:
-            model_path = "{}/{}.model.xml" .format(module_path, wm.group(1).lower())
+            top = wm.group(1).upper()
         else:
-            assert False, "included Verilog file name {} does not follow pattern %%.sim.v".format(module_basename)
-        xmlinc.include_xml(parent=models_xml, href=model_path, outfile=outfile, xptr="xpointer(models/child::node())")
-else:
-    # Is a leaf model
-    topname = tmod.attr("MODEL_NAME", top)
-    modclass = tmod.attr("CLASS", "")
-    if modclass not in ("lut", "routing", "flipflop"):
-        model_xml = ET.SubElement(models_xml, "model", {'name': topname})
-        ports = tmod.ports
-
-        inports_xml = ET.SubElement(model_xml, "input_ports")
-        outports_xml = ET.SubElement(model_xml, "output_ports")
-
-        clocks = yosys.run.list_clocks(args.infiles, top)
-        clk_sigs = dict()
-        for clk in clocks:
-            clk_sigs[clk] = yosys.run.get_clock_assoc_signals(args.infiles, top, clk)
-
-        for name, width, iodir in ports:
-            attrs = dict(name=name)
-            sinks = yosys.run.get_combinational_sinks(args.infiles, top, name)
-            if len(sinks) > 0 and iodir == "input":
-                attrs["combinational_sink_ports"] = " ".join(sinks)
-            if name in clocks:
-                attrs["is_clock"] = "1"
-            for clk in clocks:
-                if name in clk_sigs[clk]:
-                    attrs["clock"] = clk
-            if iodir == "input":
-                ET.SubElement(inports_xml, "port", attrs)
-            elif iodir == "output":
-                ET.SubElement(outports_xml, "port", attrs)
+            print("ERROR file name not of format %.sim.v ({}), cannot detect top level. Manually specify the top level module using --top".format(iname))
+            sys.exit(1)
+        yj = YosysJSON(aig_json, top)
+
+    if top is None:
+        print("ERROR: more than one module in design, cannot detect top level. Manually specify the top level module using --top")
+        sys.exit(1)
+
+    tmod = yj.top_module
+    models_xml = ET.Element("models", nsmap = {'xi': xmlinc.xi_url})
+
+    # XML dependencies need to correspond 1:1 with Verilog includes, so we have
+    # to do this manually rather than using Yosys
+    abs_base = os.path.dirname(os.path.abspath(infiles[0]))
+    deps_files = sorted(set(default_graph().includes(infiles[0])),
+                        key=lambda p: os.path.relpath(p, abs_base))
+
+    if len(deps_files) > 0:
+        # Has dependencies, not a leaf model
+        for abs_dep in deps_files:
+            module_path = os.path.dirname(abs_dep)
+            module_basename = os.path.basename(abs_dep)
+            wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", module_basename)
+            if wm:
+                model_path = "{}/{}.model.xml" .format(module_path, wm.group(1).lower())
             else:
-                assert False, "bidirectional ports not permitted in VPR models"
+                assert False, "included Verilog file name {} does not follow pattern %%.sim.v".format(module_basename)
+            xmlinc.include_xml(parent=models_xml, href=model_path, outfile=outfile, xptr="xpointer(models/child::node())")
+    else:
+        # Is a leaf model
+        topname = tmod.attr("MODEL_NAME", top)
+        modclass = tmod.attr("CLASS", "")
+        if modclass not in ("lut", "routing", "flipflop"):
+            model_xml = ET.SubElement(models_xml, "model", {'name': topname})
+            ports = tmod.ports
+
+            inports_xml = ET.SubElement(model_xml, "input_ports")
+            outports_xml = ET.SubElement(model_xml, "output_ports")
+
+            # The flattened JSON has everything needed to find the clocks and
+            # combinational paths, so Yosys doesn't need to be run again.
+            clocks = tmod.clocks()
+            comb_sinks = tmod.combinational_sinks()
+            clk_sigs = dict()
+            for clk in clocks:
+                clk_sigs[clk] = tmod.clock_assoc_signals(clk)
+
+            for name, width, iodir in ports:
+                attrs = dict(name=name)
+                sinks = comb_sinks.get(name, [])
+                if len(sinks) > 0 and iodir == "input":
+                    attrs["combinational_sink_ports"] = " ".join(sinks)
+                if name in clocks:
+                    attrs["is_clock"] = "1"
+                for clk in clocks:
+                    if name in clk_sigs[clk]:
+                        attrs["clock"] = clk
+                if iodir == "input":
+                    ET.SubElement(inports_xml, "port", attrs)
+                elif iodir == "output":
+                    ET.SubElement(outports_xml, "port", attrs)
+                else:
+                    assert False, "bidirectional ports not permitted in VPR models"
+
+
+    if len(models_xml) == 0:
+        models_xml.insert(0, ET.Comment("this file is intentionally left blank"))
+
+    write_if_changed(outfile, ET.tostring(models_xml, pretty_print=True).decode('utf-8'))
+    print("Generated {} from {}".format(outfile, iname))
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    outfile = "model.xml"
+    if "o" in args and args.o is not None:
+        outfile = args.o
 
+    vlog_to_model(args.infiles, args.top, outfile)
 
-if len(models_xml) == 0:
-    models_xml.insert(0, ET.Comment("this file is intentionally left blank"))
 
-f = open(outfile, 'w')
-f.write(ET.tostring(models_xml, pretty_print=True).decode('utf-8'))
-f.close()
-print("Generated {} from {}".format(outfile, iname))
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
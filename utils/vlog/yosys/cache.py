@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+An on-disk, content addressed cache for the JSON Yosys generates from Verilog.
+
+Entries are keyed on a hash of everything which can change the output of
+`yosys.run.vlog_to_json`; the contents of the input files and of every file
+they (transitively) `include, the Verilog defines, the flags and the mode.
+Entries are stored gzip compressed, and the least recently used entries are
+removed once the cache grows larger than its maximum size. The size of the
+cache is only measured on the first write in a process, and then kept up to
+date as entries are written, so the cache directory is only walked again when
+the cache needs shrinking.
+
+The following environment variables control the cache:
+    - `V2X_CACHE=0` : disable the cache
+
+    - `V2X_CACHE_DIR` : directory to store the cache in, defaults to
+      `.cache/yosys` in the top level of the repository.
+
+    - `V2X_CACHE_SIZE` : maximum size of the cache in megabytes, defaults to
+      256.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from lib.includes import default_graph
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", "..", ".."))
+
+# Bump when the format of the cache entries changes.
+CACHE_VERSION = 1
+
+
+def file_hash(path):
+    """Return the SHA256 hash of a file's contents, or None if it is missing."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def include_closure(infiles):
+    """Return the sorted list of files transitively `include-d by the given
+    Verilog files. Includes are resolved relative to the including file, see
+    `lib.includes.IncludeGraph`."""
+    return default_graph().closure(infiles)
+
+
+def yosys_identity(yosys):
+    """Return a string identifying the Yosys binary, so upgrading Yosys
+    invalidates the cache."""
+    path = shutil.which(yosys) or yosys
+    try:
+        st = os.stat(path)
+        return "{}:{}:{}".format(path, st.st_size, st.st_mtime)
+    except OSError:
+        return path
+
+
+class JSONCache:
+    """Cache of parsed Yosys JSON, stored compressed in a directory."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # Estimated size of the cache, None until it has been measured.
+        self.size = None
+
+    def key(self, yosys, infiles, defines, **options):
+        """Return the key for a run of Yosys.
+
+        Inputs
+        -------
+        yosys : how Yosys is run (see `yosys.run.get_yosys`)
+        infiles : list of input files
+        defines : list of Verilog defines
+        options : any other values which change the output (flags, mode...)
+        """
+        h = hashlib.sha256()
+        def add(*values):
+            for v in values:
+                h.update(str(v).encode("utf-8"))
+                h.update(b"\0")
+
+        add(CACHE_VERSION, yosys_identity(yosys))
+        for f in infiles:
+            add("infile", f, file_hash(f))
+        for f in include_closure(infiles):
+            add("include", f, file_hash(f))
+        for d in defines:
+            add("define", d)
+        for k, v in sorted(options.items()):
+            add("option", k, v)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + ".json.gz")
+
+    def get(self, key):
+        """Return the parsed JSON for a key, or None if it isn't cached."""
+        path = self.entry_path(key)
+        try:
+            with gzip.open(path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (OSError, EOFError, ValueError):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return data
+
+    def put(self, key, data):
+        """Store parsed JSON for a key, then evict old entries if the cache
+        has grown too large.
+
+        >>> d = tempfile.mkdtemp()
+        >>> cache = JSONCache(d, max_size=1)
+        >>> cache.put("aa01", {"a": 1})
+        >>> cache.get("aa01") is None
+        True
+        >>> cache = JSONCache(d, max_size=1024)
+        >>> cache.put("aa01", {"a": 1})
+        >>> cache.put("aa01", {"a": 1})
+        >>> cache.get("aa01")
+        {'a': 1}
+        >>> cache.size == os.path.getsize(cache.entry_path("aa01"))
+        True
+        >>> shutil.rmtree(d)
+        """
+        if self.size is None:
+            self.evict()
+
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(gzip.compress(json.dumps(data).encode("utf-8")))
+            new_size = f.tell()
+        os.replace(tmppath, path)
+
+        self.size += new_size - old_size
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is smaller
+        than its maximum size, and measure the size of the cache."""
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+
+def default_cache():
+    """Return the cache configured by the environment, or None if caching is
+    disabled."""
+    if os.getenv("V2X_CACHE", "1") == "0":
+        return None
+    path = os.getenv("V2X_CACHE_DIR", os.path.join(TOP_DIR, ".cache", "yosys"))
+    max_size = int(os.getenv("V2X_CACHE_SIZE", "256")) * 1024 * 1024
+    return JSONCache(path, max_size)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -9,10 +9,86 @@ be used before outputting the JSON.
 import os, sys
 import json
 
+# The combinational Yosys internal cell types, the cells which can be evaluated
+# (see `CellTypes::setup_internals_eval` and `setup_stdcells_eval` in Yosys'
+# kernel/celltypes.h). Everything else, including `$paramod` modules and
+# cells like `$specify2`, `$print` or `$scopeinfo`, is not combinational.
+_comb_cell_types = frozenset([
+    # Word level cells
+    "$not", "$pos", "$neg",
+    "$reduce_and", "$reduce_or", "$reduce_xor", "$reduce_xnor", "$reduce_bool",
+    "$logic_not", "$logic_and", "$logic_or",
+    "$and", "$or", "$xor", "$xnor", "$bweqx",
+    "$shl", "$shr", "$sshl", "$sshr", "$shift", "$shiftx",
+    "$lt", "$le", "$eq", "$ne", "$eqx", "$nex", "$ge", "$gt",
+    "$add", "$sub", "$mul", "$div", "$mod", "$divfloor", "$modfloor", "$pow",
+    "$slice", "$concat", "$mux", "$pmux", "$bmux", "$demux", "$bwmux",
+    "$lut", "$sop", "$lcu", "$alu", "$fa", "$macc",
+    # Gate level cells
+    "$_BUF_", "$_NOT_", "$_AND_", "$_NAND_", "$_OR_", "$_NOR_", "$_XOR_",
+    "$_XNOR_", "$_ANDNOT_", "$_ORNOT_", "$_MUX_", "$_NMUX_", "$_MUX4_",
+    "$_MUX8_", "$_MUX16_", "$_AOI3_", "$_OAI3_", "$_AOI4_", "$_OAI4_",
+])
+
+def is_combinational_cell(ctype):
+    """Return true if a cell type is a combinational Yosys internal cell. These
+    are the cells which Yosys' `%coe` select expansion goes through.
+
+    >>> is_combinational_cell("$and"), is_combinational_cell("$_AND_")
+    (True, True)
+    >>> is_combinational_cell("$dff"), is_combinational_cell("$_DFF_P_")
+    (False, False)
+    >>> is_combinational_cell("$mem"), is_combinational_cell("$_SR_NN_")
+    (False, False)
+    >>> is_combinational_cell("$paramod\\\\SUB\\\\WIDTH=1")
+    False
+    >>> [is_combinational_cell(t) for t in ("$specify2", "$print", "$scopeinfo")]
+    [False, False, False]
+    >>> is_combinational_cell("SLICEL")
+    False
+    """
+    return ctype in _comb_cell_types
+
+def _attr_is_true(value):
+    """Yosys writes integer attributes either as integers or as strings of
+    binary digits, depending on the version."""
+    if isinstance(value, str):
+        return value.strip("0") == "1"
+    return value == 1
+
+def _example_module():
+    """A small hand written netlist for the doctests below. `A & B` goes
+    through a `$not` to `Y` and into a `$dff` clocked by `CLK` which drives
+    `Q`. `E` drives `Z` through a `$paramod` instance, and `R` is only
+    associated with `CLK` by its ASSOC_CLOCK attribute.
+    """
+    def cell(ctype, **conns):
+        dirs = dict((p, "output" if p in ("Y", "Q") else "input") for p in conns)
+        return {"type": ctype, "connections": conns,
+                "port_directions": dirs, "attributes": {}}
+    ports = {"CLK": 2, "A": 3, "B": 4, "E": 5, "R": 6, "Q": 7, "Y": 8, "Z": 9}
+    netnames = dict((p, {"bits": [n], "attributes": {}}) for p, n in ports.items())
+    netnames["R"]["attributes"]["ASSOC_CLOCK"] = "CLK"
+    netnames["$and$1_Y"] = {"bits": [10], "attributes": {}}
+    return YosysModule("top", {
+        "attributes": {},
+        "ports": dict((p, {"direction": "output" if p in "QYZ" else "input",
+                           "bits": [n]}) for p, n in ports.items()),
+        "cells": {
+            "$and$1": cell("$and", A=[3], B=[4], Y=[10]),
+            "$not$2": cell("$not", A=[10], Y=[8]),
+            "$dff$3": cell("$dff", CLK=[2], D=[10], Q=[7]),
+            "sub": cell("$paramod\\SUB\\WIDTH=1", A=[5], Y=[9]),
+        },
+        "netnames": netnames,
+    })
+
 class YosysModule:
     def __init__(self, name, module_data):
         self.name = name
         self.data = module_data
+        self._graph = None
+        self._conn_index = None
 
     @property
     def ports(self):
@@ -50,10 +126,10 @@ class YosysModule:
 
     def cell_type(self, cell):
         """Return the type of a given cell"""
-        for cname, cdata in self.data["cells"].items():
-            if cname == cell:
-                return cdata["type"]
-        return None
+        cdata = self.data["cells"].get(cell, None)
+        if cdata is None:
+            return None
+        return cdata["type"]
 
     @property
     def module_attrs(self):
@@ -121,6 +197,58 @@ class YosysModule:
                         conns.append(("{}[{}]".format(port, i), condata[i]))
         return conns
 
+    @property
+    def conn_index(self):
+        """Index from net number to the top level IO and cell ports connected
+        to it, built once on first use so `conn_io` and `conn_ports` don't
+        have to scan every port and cell.
+
+        Returns a tuple of dictionaries, both keyed on (direction, net):
+        -------
+        io : list of port names, see `conn_io`
+        ports : list of (cell, port) tuples, see `conn_ports`
+
+        Cells with Yosys internal names (beginning with $) are not indexed.
+
+        >>> io, ports = _example_module().conn_index
+        >>> sorted(io.items())
+        [(('input', 2), ['CLK']), (('input', 3), ['A']), (('input', 4), ['B']), (('input', 5), ['E']), (('input', 6), ['R']), (('output', 7), ['Q']), (('output', 8), ['Y']), (('output', 9), ['Z'])]
+        >>> sorted(ports.items())
+        [(('input', 5), [('sub', 'A')]), (('output', 9), [('sub', 'Y')])]
+        """
+        if self._conn_index is not None:
+            return self._conn_index
+
+        def add(index, direction, condata, value):
+            # Each port is only added once per net, with the first index
+            # the net appears at.
+            seen = set()
+            for i, net in enumerate(condata):
+                if net in seen:
+                    continue
+                seen.add(net)
+                if len(condata) == 1:
+                    name = value
+                else:
+                    name = "{}[{}]".format(value, i) if isinstance(value, str) \
+                        else (value[0], "{}[{}]".format(value[1], i))
+                index.setdefault((direction, net), []).append(name)
+
+        io_index = {}
+        for port, pdata in sorted(self.data["ports"].items()):
+            add(io_index, pdata["direction"], pdata["bits"], port)
+
+        ports_index = {}
+        for cell in sorted(self.data["cells"].keys()):
+            if cell.startswith("$"):
+                continue
+            cdata = self.data["cells"][cell]
+            for port, condata in sorted(cdata["connections"].items()):
+                add(ports_index, cdata["port_directions"][port], condata, (cell, port))
+
+        self._conn_index = (io_index, ports_index)
+        return self._conn_index
+
     def conn_io(self, net, iodir):
         """Returns a list of top level IO matching a direction and connected net number
 
@@ -128,15 +256,8 @@ class YosysModule:
         -------
         port : str
         """
-        conn_io = []
-        for port, pdata in sorted(self.data["ports"].items()):
-            if pdata["direction"] == iodir:
-                if net in pdata["bits"]:
-                    if len(pdata["bits"]) == 1:
-                        conn_io.append(port)
-                    else:
-                        conn_io.append("{}[{}]".format(port, pdata["bits"].index(net)))
-        return conn_io
+        io_index, _ = self.conn_index
+        return list(io_index.get((iodir, net), []))
 
     def conn_ports(self, net, pdir):
         """Returns any cell ports matching a direction and connected net number
@@ -146,20 +267,8 @@ class YosysModule:
         cell : str
         port : str
         """
-        conn_ports = []
-        for cell in sorted(self.data["cells"].keys()):
-            if cell.startswith("$"):
-                continue
-            cdata = self.data["cells"][cell]
-            for port, condata in sorted(cdata["connections"].items()):
-                if cdata["port_directions"][port] == pdir:
-                    if net in condata:
-                        if len(condata) == 1:
-                            conn_ports.append((cell, port))
-                        else:
-                            conn_ports.append((cell, "{}[{}]".format(port, condata.index(net))))
-        return conn_ports
-
+        _, ports_index = self.conn_index
+        return list(ports_index.get((pdir, net), []))
 
     def net_drivers(self, net):
         """Returns a list of drivers of a given net, both top level inputs.
@@ -191,6 +300,156 @@ class YosysModule:
         cell_drivers = self.conn_ports(net, "input")
         return io_drivers + cell_drivers
 
+    # The functions below provide the same results as the Yosys select
+    # commands in `yosys.run`, but are computed directly from the JSON (which
+    # should be flattened) so no more Yosys runs are needed.
+
+    def _port_bits(self):
+        """Dictionary of port name to the list of net numbers of its bits"""
+        return dict((port, [b for b in pdata["bits"] if isinstance(b, int)])
+                    for port, pdata in self.data["ports"].items())
+
+    @property
+    def graph(self):
+        """Connectivity of the nets in the module, built once on first use.
+
+        Returns a tuple:
+        -------
+        comb_fanout : dict
+            Net number to the list of output nets of combinational cells
+            which have the net as an input
+        component : dict
+            Net number to a representative net number, where nets connected
+            through any cell share the same representative
+        clk_nets : set
+            Net numbers connected to a cell port named CLK
+
+        >>> comb_fanout, component, clk_nets = _example_module().graph
+        >>> sorted(comb_fanout.items())
+        [(3, [10]), (4, [10]), (10, [8])]
+        >>> component[3] == component[7] == component[8], component[5] == component[9]
+        (True, True)
+        >>> component[3] == component[5]
+        False
+        >>> clk_nets
+        {2}
+        """
+        if self._graph is not None:
+            return self._graph
+
+        comb_fanout = {}
+        parent = {}
+        def find(n):
+            root = n
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[n] != root:
+                parent[n], n = root, parent[n]
+            return root
+
+        clk_nets = set()
+        for cell, cdata in self.data["cells"].items():
+            inputs, outputs = [], []
+            for port, condata in cdata["connections"].items():
+                bits = [b for b in condata if isinstance(b, int)]
+                if port == "CLK":
+                    clk_nets.update(bits)
+                if cdata["port_directions"].get(port) == "output":
+                    outputs.extend(bits)
+                else:
+                    inputs.extend(bits)
+            all_bits = inputs + outputs
+            for b in all_bits[1:]:
+                parent[find(b)] = find(all_bits[0])
+            if is_combinational_cell(cdata["type"]):
+                for b in inputs:
+                    comb_fanout.setdefault(b, []).extend(outputs)
+
+        component = dict((n, find(n)) for n in list(parent.keys()))
+        self._graph = (comb_fanout, component, clk_nets)
+        return self._graph
+
+    def combinational_sinks(self):
+        """Find the output ports which are combinational sinks of each input
+        port, with one pass over the nets.
+
+        Returns a dictionary of input port name to a list of output port names.
+
+        `Q` is behind the `$dff`, and `Z` is behind a module instance, so
+        neither is a combinational sink.
+
+        >>> sorted(_example_module().combinational_sinks().items())
+        [('A', ['Y']), ('B', ['Y']), ('CLK', []), ('E', []), ('R', [])]
+        """
+        comb_fanout, _, _ = self.graph
+        port_bits = self._port_bits()
+        inputs = [name for name, width, iodir in self.ports if iodir == "input"]
+        outputs = [name for name, width, iodir in self.ports if iodir == "output"]
+
+        # Each net gets a bit mask of the inputs which reach it.
+        reach = {}
+        todo = []
+        for i, name in enumerate(inputs):
+            for b in port_bits[name]:
+                reach[b] = reach.get(b, 0) | (1 << i)
+                todo.append(b)
+        while todo:
+            b = todo.pop()
+            mask = reach[b]
+            for o in comb_fanout.get(b, []):
+                new = reach.get(o, 0) | mask
+                if new != reach.get(o, 0):
+                    reach[o] = new
+                    todo.append(o)
+
+        sinks = dict((name, []) for name in inputs)
+        for oname in outputs:
+            mask = 0
+            for b in port_bits[oname]:
+                mask |= reach.get(b, 0)
+            for i, iname in enumerate(inputs):
+                if mask & (1 << i) and oname != iname:
+                    sinks[iname].append(oname)
+        return sinks
+
+    def clocks(self):
+        """List of ports which are clocks, either because they are connected
+        to a CLK port of a cell or they have the CLOCK attribute set.
+
+        >>> _example_module().clocks()
+        ['CLK']
+        """
+        _, _, clk_nets = self.graph
+        port_bits = self._port_bits()
+        clocks = []
+        for name, width, iodir in self.ports:
+            if clk_nets.intersection(port_bits[name]) or \
+                    _attr_is_true(self.net_attr(name, "CLOCK", 0)):
+                clocks.append(name)
+        return clocks
+
+    def clock_assoc_signals(self, clk):
+        """List of signals associated with a given clock; the ports connected
+        (through any number of cells) to the clock, and the nets with the
+        ASSOC_CLOCK attribute set to the clock.
+
+        >>> _example_module().clock_assoc_signals("CLK")
+        ['A', 'B', 'Q', 'R', 'Y']
+        """
+        _, component, _ = self.graph
+        port_bits = self._port_bits()
+        clk_comps = set(component.get(b, b) for b in port_bits.get(clk, []))
+
+        signals = set()
+        for name, width, iodir in self.ports:
+            if any(component.get(b, b) in clk_comps for b in port_bits[name]):
+                signals.add(name)
+        for netname, ndata in self.data["netnames"].items():
+            if ndata["attributes"].get("ASSOC_CLOCK", None) == clk:
+                signals.add(netname)
+        signals.discard(clk)
+        return sorted(signals)
+
 class YosysJSON:
 
     def __init__(self, j, top = None):
@@ -244,3 +503,8 @@ class YosysJSON:
         src = self.module(module).attr("src")
         cpos = src.rfind(":")
         return src[0:cpos]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os, subprocess, sys, re
-import tempfile, json
+import atexit, threading
+import yosys.cache
 import yosys.utils
 
 def get_yosys():
@@ -8,10 +9,150 @@ def get_yosys():
     `yosys`."""
     return os.getenv("YOSYS", "yosys")
 
-def get_output(params):
-    """Run Yosys with given command line parameters, and return stdout as a string"""
+def get_output(params, binary = False):
+    """Run Yosys with given command line parameters, and return stdout as a
+    string (or as bytes if binary is set)"""
     cmd = [get_yosys()] + params
-    return subprocess.check_output(cmd).decode("utf-8")
+    output = subprocess.check_output(cmd)
+    if binary:
+        return output
+    return output.decode("utf-8")
+
+class YosysWorker:
+    """A long running Yosys process which is fed batches of commands over
+    stdin, so the Yosys startup cost is only paid once rather than once per
+    batch.
+
+    The design (and any Verilog defines, which the include guards in the
+    `.sim.v` files depend on) is reset before every batch. Commands should
+    write anything they want returned to `/dev/stdout`; the end of a batch is
+    marked on stdout so its output can be split from that of the next batch.
+    The marker can't contain `#`, which starts a comment in Yosys scripts.
+
+    >>> "#" in YosysWorker.marker
+    False
+    """
+    marker = "V2X-YOSYS-WORKER-DONE"
+    reset_commands = "design -reset; verilog_defines -reset"
+
+    def __init__(self):
+        self.proc = None
+
+    def start(self):
+        """Start the Yosys process, reading the script from stdin"""
+        self.proc = subprocess.Popen(
+            [get_yosys(), "-q", "-s", "/dev/stdin"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def alive(self):
+        """Return true if the Yosys process is running"""
+        return self.proc is not None and self.proc.poll() is None
+
+    def run(self, commands, binary = False):
+        """Run a string containing Yosys commands on an empty design, and
+        return what they wrote to stdout as a string. If Yosys exits (for
+        example on an error) a `subprocess.CalledProcessError` is raised and a
+        new process will be started for the next batch.
+
+        Inputs
+        -------
+        commands : string of Yosys commands to run
+        binary : return the output as bytes rather than a string
+        """
+        if not self.alive():
+            self.start()
+
+        script = "{}\n{}\ntee -q -a /dev/stdout log {}\n".format(
+            self.reset_commands, commands, self.marker)
+        try:
+            self.proc.stdin.write(script.encode("utf-8"))
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+        output = []
+        for line in self.proc.stdout:
+            if line.rstrip(b"\n") == self.marker.encode("utf-8"):
+                output = b"".join(output)
+                return output if binary else output.decode("utf-8")
+            output.append(line)
+
+        # Yosys exited before finishing the batch
+        returncode = self.proc.wait()
+        self.proc = None
+        raise subprocess.CalledProcessError(
+            returncode, [get_yosys()], b"".join(output), None)
+
+    def close(self):
+        """Stop the Yosys process"""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
+        self.proc = None
+
+class YosysWorkerPool:
+    """A pool of warm `YosysWorker` processes. Batches can be run from several
+    threads at once, each using its own worker, and workers are reused rather
+    than being restarted for every batch."""
+
+    def __init__(self, size = None):
+        self.size = size or os.cpu_count() or 1
+        self.idle = []
+        self.started = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Get an idle worker, starting a new one if the pool isn't full yet"""
+        with self.cond:
+            while not self.idle and self.started >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        return YosysWorker()
+
+    def release(self, worker):
+        """Return a worker to the pool"""
+        with self.cond:
+            self.idle.append(worker)
+            self.cond.notify()
+
+    def run(self, commands, binary = False):
+        """Run a string containing Yosys commands on one of the workers, see
+        `YosysWorker.run`"""
+        worker = self.acquire()
+        try:
+            return worker.run(commands, binary)
+        finally:
+            self.release(worker)
+
+    def close(self):
+        """Stop all the idle workers in the pool"""
+        with self.cond:
+            for worker in self.idle:
+                worker.close()
+                self.started -= 1
+            self.idle = []
+
+worker_pool = None
+
+def use_worker_pool(size = None):
+    """Run all further commands using a pool of persistent Yosys processes
+    rather than starting a new Yosys for each one.
+
+    Inputs
+    -------
+    size : maximum number of Yosys processes, defaults to the number of CPUs
+    """
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = YosysWorkerPool(size)
+        atexit.register(worker_pool.close)
+    return worker_pool
 
 defines = []
 
@@ -19,21 +160,28 @@ def add_define(defname):
     """Add a Verilog define to the list of defines to set in Yosys"""
     defines.append(defname)
 
+def remove_define(defname):
+    """Remove a Verilog define from the list of defines to set in Yosys"""
+    defines.remove(defname)
+
 def get_defines():
     """Return a list of set Verilog defines, as a list of arguments to pass to Yosys `read_verilog`"""
     return " ".join(["-D" + _ for _ in defines])
 
-def commands(commands, infiles = []):
+def commands(commands, infiles = [], binary = False):
     """Run a given string containing Yosys commands
 
     Inputs
     -------
     commands : string of Yosys commands to run
     infiles : list of input files
+    binary : return the output as bytes rather than a string
     """
     commands = "read_verilog {} {}; ".format(get_defines(), " ".join(infiles)) + commands
+    if worker_pool is not None:
+        return worker_pool.run(commands, binary)
     params = ["-q", "-p", commands]
-    return get_output(params)
+    return get_output(params, binary)
 
 def script(script, infiles = []):
     """Run a Yosys script given a path to the script
@@ -46,6 +194,56 @@ def script(script, infiles = []):
     params = ["-q", "-s", script] + infiles
     return get_output(params)
 
+frame_marker = "V2X-FRAME-END"
+
+def framed_commands(cmds):
+    """Join a list of Yosys commands which write to `/dev/stdout` into one
+    string, logging a marker to stdout after each so that `split_frames` can
+    split up their output again.
+
+    >>> framed_commands(["select -write /dev/stdout a", "select -write /dev/stdout b"])
+    'select -write /dev/stdout a; tee -q -a /dev/stdout log V2X-FRAME-END 0; select -write /dev/stdout b; tee -q -a /dev/stdout log V2X-FRAME-END 1'
+    """
+    return "; ".join("{}; tee -q -a /dev/stdout log {} {}".format(cmd, frame_marker, i)
+                     for i, cmd in enumerate(cmds))
+
+def split_frames(output, count):
+    """Split the output of commands joined by `framed_commands` into a list
+    containing the output of each command. The output can be a string or
+    bytes.
+
+    >>> split_frames("A/x\\nV2X-FRAME-END 0\\nV2X-FRAME-END 1\\n", 2)
+    ['A/x\\n', '']
+    >>> split_frames(b"{}\\nV2X-FRAME-END 0\\n", 1)
+    [b'{}\\n']
+    """
+    binary = isinstance(output, bytes)
+    frames = []
+    current = []
+    for line in output.splitlines(keepends=True):
+        marker = "{} {}".format(frame_marker, len(frames))
+        if binary:
+            marker = marker.encode("utf-8")
+        if line.rstrip(b"\n" if binary else "\n") == marker:
+            frames.append(output[:0].join(current))
+            current = []
+        else:
+            current.append(line)
+    if len(frames) != count:
+        raise ValueError("expected {} frames of Yosys output, got {}".format(count, len(frames)))
+    return frames
+
+def json_commands(outfile, flatten = False, aig = False, mode = None, module_with_mode = None):
+    """Return the Yosys commands to prepare the design and write it as JSON
+    to outfile. See `vlog_to_json` for the other inputs."""
+    prep_opts = "-flatten" if flatten else ""
+    json_opts = "-aig" if aig else ""
+    if mode is not None:
+        mode_str = 'chparam -set MODE "{}" {}; '.format(mode, module_with_mode)
+    else:
+        mode_str = ""
+    return "{}prep {}; write_json {} {}".format(mode_str, prep_opts, json_opts, outfile)
+
 def vlog_to_json(infiles, flatten = False, aig = False, mode = None, module_with_mode = None):
     """
     Convert Verilog to a JSON representation using Yosys
@@ -57,18 +255,64 @@ def vlog_to_json(infiles, flatten = False, aig = False, mode = None, module_with
     aig : generate And-Inverter-Graph modules for gates
     mode : set to a value other than None to use `chparam` to set the value of the MODE parameter
     module_with_mode : the name of the module to apply `mode` to
+
+    The result is cached on disk, see `yosys.cache`.
     """
-    prep_opts = "-flatten" if flatten else ""
-    json_opts = "-aig" if aig else ""
-    if mode is not None:
-        mode_str = 'chparam -set MODE "{}" {}; '.format(mode, module_with_mode)
-    else:
-        mode_str = ""
-    cmds = "{}prep {}; write_json {}".format(mode_str, prep_opts, json_opts)
-    j = yosys.utils.strip_yosys_json(commands(cmds, infiles))
-    """with open('dump.json', 'w') as dbg:
-        print(j,file=dbg)"""
-    return json.loads(j)
+    cache = yosys.cache.default_cache()
+    if cache is not None:
+        key = cache.key(get_yosys(), infiles, defines, flatten=flatten, aig=aig,
+                        mode=mode, module_with_mode=module_with_mode)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    cmds = json_commands("/dev/stdout", flatten, aig, mode, module_with_mode)
+    data = yosys.utils.loads_yosys_json(commands(cmds, infiles, binary=True))
+    if cache is not None:
+        cache.put(key, data)
+    return data
+
+def vlog_to_json_modes(infiles, modes, module_with_mode, flatten = False, aig = False):
+    """
+    Convert Verilog to a JSON representation using Yosys, once for each value
+    of the MODE parameter. The input files are only read once; the design is
+    saved after reading and restored before applying each mode, so a single
+    Yosys process is run for all the modes.
+
+    Returns a dictionary mapping each mode to its JSON.
+
+    Inputs
+    -------
+    infiles : list of input files
+    modes : list of values for the MODE parameter
+    module_with_mode : the name of the module to apply the modes to
+    flatten : set to flatten output hierarchy
+    aig : generate And-Inverter-Graph modules for gates
+    """
+    results = dict()
+    keys = dict()
+    cache = yosys.cache.default_cache()
+    if cache is not None:
+        for mode in modes:
+            keys[mode] = cache.key(get_yosys(), infiles, defines, flatten=flatten, aig=aig,
+                                   mode=mode, module_with_mode=module_with_mode)
+            data = cache.get(keys[mode])
+            if data is not None:
+                results[mode] = data
+
+    todo = [mode for mode in modes if mode not in results]
+    if len(todo) == 0:
+        return results
+
+    mode_cmds = ["design -load v2x_base; " + json_commands("/dev/stdout", flatten, aig, mode, module_with_mode)
+                 for mode in todo]
+    output = commands("design -save v2x_base; " + framed_commands(mode_cmds), infiles, binary=True)
+
+    for mode, j in zip(todo, split_frames(output, len(todo))):
+        results[mode] = yosys.utils.loads_yosys_json(j)
+        if cache is not None:
+            cache.put(keys[mode], results[mode])
+    return results
 
 
 def extract_pin(module, pstr, _regex=re.compile(r"([^/]+)/([^/]+)")):
@@ -90,6 +334,48 @@ def extract_pin(module, pstr, _regex=re.compile(r"([^/]+)/([^/]+)")):
 
 
 
+def parse_select(module, output):
+    """
+    Parse the output of a Yosys `select -write` command and return it as a
+    list of pins
+
+    Inputs
+    -------
+    module: Name of module to extract pins from
+    output: String written by the select command
+
+    >>> parse_select("TOP", "TOP/A\\nOTHER/B\\n\\nTOP/C\\n")
+    ['A', 'C']
+    """
+    pins = []
+    for net in output.splitlines():
+        snet = net.strip()
+        if(len(snet) > 0):
+            pin = extract_pin(module, snet)
+            if pin is not None:
+                pins.append(pin)
+    return pins
+
+
+def do_select_multi(infiles, module, exprs):
+    """
+    Run several Yosys select commands (given the expressions and input files)
+    on a module using a single Yosys process, and return the results as a list
+    containing a list of pins for each expression
+
+    Inputs
+    -------
+    infiles: List of Verilog source files to pass to Yosys
+    module: Name of module to run commands on
+    exprs: List of Yosys selector expressions for select commands
+    """
+    if len(exprs) == 0:
+        return []
+
+    sel_cmds = framed_commands(["select -write /dev/stdout {}".format(expr) for expr in exprs])
+    output = commands("prep -top {} -flatten; cd {}; {}".format(module, module, sel_cmds), infiles)
+    return [parse_select(module, frame) for frame in split_frames(output, len(exprs))]
+
 def do_select(infiles, module, expr):
     """
     Run a Yosys select command (given the expression and input files) on a module
@@ -101,25 +387,20 @@ def do_select(infiles, module, expr):
     module: Name of module to run command on
     expr: Yosys selector expression for select command
     """
+    return do_select_multi(infiles, module, [expr])[0]
 
-    """TODO: All of these functions involve a fairly large number of calls to Yosys
-    Although performance here is unlikely to be a major priority any time soon,
-    it might be worth investigating better options?"""
+def combinational_sinks_expr(innet):
+    """Yosys selector expression for the output ports which are combinational
+    sinks of a given input."""
+    return "{} %coe* o:* %i {} %d".format(innet, innet)
 
+def clocks_expr():
+    """Yosys selector expression for the clocks in a module."""
+    return "c:* %x:+[CLK] a:CLOCK=1 %u c:* %d"
 
-    outfile = tempfile.mktemp()
-    sel_cmd = "prep -top {} -flatten; cd {}; select -write {} {}" .format(module, module, outfile, expr)
-    commands(sel_cmd, infiles)
-    pins = []
-    with open(outfile, 'r') as f:
-        for net in f:
-            snet = net.strip()
-            if(len(snet) > 0):
-                pin = extract_pin(module, snet)
-                if pin is not None:
-                    pins.append(pin)
-    os.remove(outfile)
-    return pins
+def clock_assoc_signals_expr(clk):
+    """Yosys selector expression for the signals associated with a given clock."""
+    return "select -list {} %x* i:* o:* %u %i a:ASSOC_CLOCK={} %u {} %d".format(clk, clk, clk)
 
 def get_combinational_sinks(infiles, module, innet):
     """Return a list of output ports which are combinational sinks of a given
@@ -131,7 +412,7 @@ def get_combinational_sinks(infiles, module, innet):
     module: Name of module to run command on
     innet: Name of input net to find sinks of
     """
-    return do_select(infiles, module, "{} %coe* o:* %i {} %d".format(innet, innet))
+    return do_select(infiles, module, combinational_sinks_expr(innet))
 
 def list_clocks(infiles, module):
     """Return a list of clocks in the module
@@ -141,7 +422,7 @@ def list_clocks(infiles, module):
     infiles: List of Verilog source files to pass to Yosys
     module: Name of module to run command on
     """
-    return do_select(infiles, module, "c:* %x:+[CLK] a:CLOCK=1 %u c:* %d")
+    return do_select(infiles, module, clocks_expr())
 
 def get_clock_assoc_signals(infiles, module, clk):
     """Return the list of signals associated with a given clock.
@@ -152,4 +433,32 @@ def get_clock_assoc_signals(infiles, module, clk):
     module: Name of module to run command on
     clk: Name of clock to find associated signals
     """
-    return do_select(infiles, module, "select -list {} %x* i:* o:* %u %i a:ASSOC_CLOCK={} %u {} %d".format(clk, clk, clk))
+    return do_select(infiles, module, clock_assoc_signals_expr(clk))
+
+def get_clocks_and_combinational_sinks(infiles, module, innets):
+    """Return the list of clocks in the module, and a dictionary mapping each
+    of the given inputs to the list of output ports which are its
+    combinational sinks. All queries are run in a single Yosys process.
+
+    Inputs
+    -------
+    infiles: List of Verilog source files to pass to Yosys
+    module: Name of module to run command on
+    innets: List of names of input nets to find sinks of
+    """
+    exprs = [clocks_expr()] + [combinational_sinks_expr(innet) for innet in innets]
+    results = do_select_multi(infiles, module, exprs)
+    return results[0], dict(zip(innets, results[1:]))
+
+def get_clock_assoc_signals_multi(infiles, module, clks):
+    """Return a dictionary mapping each of the given clocks to the list of
+    signals associated with it. All queries are run in a single Yosys process.
+
+    Inputs
+    -------
+    infiles: List of Verilog source files to pass to Yosys
+    module: Name of module to run command on
+    clks: List of names of clocks to find associated signals
+    """
+    results = do_select_multi(infiles, module, [clock_assoc_signals_expr(clk) for clk in clks])
+    return dict(zip(clks, results))
@@ -1,11 +1,56 @@
 #!/usr/bin/env python3
+import json
 import re
 
+try:
+    import orjson as fastjson
+except ImportError:
+    try:
+        import ujson as fastjson
+    except ImportError:
+        fastjson = None
+
 """The JSON Yosys outputs isn't acutally compliant JSON, as it contains C-style
 comments. These must be stripped."""
 
+# Strings are matched so that anything which looks like a comment inside one is
+# kept, everything else matched is a comment or line continuation to remove.
+_strip_re = re.compile(rb'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|\\\n', re.DOTALL)
+
+def _keep_string(m):
+    return m.group(1) or b''
+
+def strip_yosys_json_bytes(data):
+    """Strip comments from the JSON output by Yosys, given as bytes, in a
+    single pass.
+
+    >>> strip_yosys_json_bytes(b'{"a": "x//y" // c\\n /* c\\n */ }')
+    b'{"a": "x//y" \\n  }'
+    """
+    if b'/' not in data and b'\\\n' not in data:
+        return data
+    return _strip_re.sub(_keep_string, data)
+
 def strip_yosys_json(text):
-    stripped = re.sub(r'\\\n', '', text)
-    stripped = re.sub(r'//.*\n', '\n', stripped)
-    stripped = re.sub(r'/\*.*\*/', '', stripped)
-    return stripped
+    """Strip comments from the JSON output by Yosys, given as a string.
+
+    >>> strip_yosys_json('{"a": 1} /* c */')
+    '{"a": 1} '
+    """
+    return strip_yosys_json_bytes(text.encode("utf-8")).decode("utf-8")
+
+def loads_yosys_json(data):
+    """Parse the JSON output by Yosys, given as bytes, using a faster JSON
+    library (orjson or ujson) if one is installed.
+
+    >>> loads_yosys_json(b'{"modules": {"A": {}}} // done\\n')
+    {'modules': {'A': {}}}
+    """
+    data = strip_yosys_json_bytes(data)
+    if fastjson is not None:
+        return fastjson.loads(data)
+    return json.loads(data)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()